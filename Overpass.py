@@ -1,30 +1,44 @@
 import sys
 import requests
-import random
-import time
 import json
+import time
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
+import http_client
+import metrics
+import overpass_pool
+from building_store import BuildingStoreBuilder, parse_timestamp
+from city_boundary import boundary_from_geojson, overpass_poly_filters
 
-def fetch_bounding_box(city_name, country_name):
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+OVERPASS_URL = "http://overpass-api.de/api/interpreter"
+# Comma-separated interpreter URLs; queries are spread over them and fail over between them
+OVERPASS_ENDPOINTS = [url.strip() for url in os.environ.get("OVERPASS_ENDPOINTS", OVERPASS_URL).split(',') if url.strip()]
+
+# Building types kept in the saved datasets
+BUILDING_TYPES = ("yes", "house", "commercial")
+# Server-side timeout in seconds for queries over a whole city; Overpass cuts a result off when it is exceeded
+CITY_QUERY_TIMEOUT = 300
+
+def fetch_city_boundary(city_name, country_name):
     """
-    Fetches the bounding box for a given city name and country name using Nominatim API.
+    Fetches the bounding box and boundary polygon for a given city name and country name using Nominatim API.
 
     Parameters:
-        city_name (str): Name of the city to fetch the bounding box for.
-        country_name (str): Name of the country to fetch the bounding box for.
+        city_name (str): Name of the city to fetch the boundary for.
+        country_name (str): Name of the country to fetch the boundary for.
 
     Returns:
-        tuple: A tuple containing (south, west, north, east) coordinates defining the bounding box.
+        tuple: The (south, west, north, east) bounding box and the city polygon (None if Nominatim has no polygon for the place), or None if the request failed.
     """
     query = f"{city_name}, {country_name}"
-    url = f"https://nominatim.openstreetmap.org/search?q={query}&format=json&polygon_geojson=1"
+    url = f"{NOMINATIM_URL}?q={query}&format=json&polygon_geojson=1"
     headers = {
         "User-Agent": "YourAppName/1.0 (your-email@example.com)"
     }
     try:
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, stage="nominatim", headers=headers)
         response.raise_for_status()  # Check if the request was successful
         data = response.json()
     except requests.exceptions.RequestException as e:
@@ -39,37 +53,53 @@ def fetch_bounding_box(city_name, country_name):
         raise ValueError(f"No bounding box found for city: {city_name} in country: {country_name}")
 
     bbox = data[0]['boundingbox']
-    return float(bbox[0]), float(bbox[2]), float(bbox[1]), float(bbox[3])
+    return (float(bbox[0]), float(bbox[2]), float(bbox[1]), float(bbox[3])), boundary_from_geojson(data[0].get('geojson'))
 
-def fetch_building_data(city_name, country_name, max_elements=100):
+def fetch_bounding_box(city_name, country_name):
     """
-    Fetches a random sample of building IDs and their coordinates from OpenStreetMap within a specified city, categorized by building types.
+    Fetches the bounding box for a given city name and country name using Nominatim API.
 
     Parameters:
-        city_name (str): Name of the city to fetch the building data for.
-        country_name (str): Name of the country to fetch the building data for.
-        max_elements (int): Maximum number of building elements to fetch.
+        city_name (str): Name of the city to fetch the bounding box for.
+        country_name (str): Name of the country to fetch the bounding box for.
 
     Returns:
-        dict: Dictionary containing lists of dictionaries with building IDs and their coordinates, categorized by building types.
+        tuple: A tuple containing (south, west, north, east) coordinates defining the bounding box.
     """
-    # Fetch bounding box for the city
-    bbox = fetch_bounding_box(city_name, country_name)
-    if bbox is None:
-        print(f"Failed to fetch bounding box for city: {city_name} in country: {country_name}")
-        return None
-    south, west, north, east = bbox
+    boundary = fetch_city_boundary(city_name, country_name)
+    return boundary[0] if boundary else None
+
+def fetch_building_centers(south, west, north, east, polygon=None):
+    """
+    Fetches the IDs, center coordinates, types and versions of all buildings within a bounding box using the Overpass API.
+
+    Parameters:
+        south (float): Southern latitude of the bounding box.
+        west (float): Western longitude of the bounding box.
+        north (float): Northern latitude of the bounding box.
+        east (float): Eastern longitude of the bounding box.
+        polygon (shapely.geometry.base.BaseGeometry): Optional city boundary; only buildings inside it are returned.
+
+    Returns:
+        BuildingStore: Building IDs, coordinates, types, versions and timestamps, or None if the request failed.
+    """
+    # Query a simplified outline of the city polygon when there is one, so Overpass skips most buildings outside it
+    if polygon is not None:
+        area_filters = "\n".join(f'      way["building"](poly:"{poly}");' for poly in overpass_poly_filters(polygon))
+    else:
+        area_filters = f'      way["building"]({south},{west},{north},{east});'
 
     # Overpass API query
     query = f"""
-    [out:json][timeout:25];
+    [out:json][timeout:{CITY_QUERY_TIMEOUT}];
     (
-      way["building"]({south},{west},{north},{east});
+{area_filters}
     );
-    out center;
+    out center meta;
     """
     try:
-        response = requests.get("http://overpass-api.de/api/interpreter", params={'data': query})
+        response = overpass_pool.get_pool(OVERPASS_ENDPOINTS).query(query, stage="overpass",
+                                                                     timeout=(10, CITY_QUERY_TIMEOUT + 30))
         response.raise_for_status()  # Check if the request was successful
         data = response.json()
         print(f"Fetched {len(data['elements'])} buildings")
@@ -80,18 +110,144 @@ def fetch_building_data(city_name, country_name, max_elements=100):
         print(f"Error parsing JSON response for building data: {e}")
         print(f"Response content: {response.text}")
         return None
+    # Overpass answers 200 with the elements found so far and a remark when the query times out or runs out of memory
+    if 'remark' in data:
+        print(f"Incomplete building data: {data['remark']}")
+        return None
 
-    # Extract building way IDs and their coordinates
-    all_buildings = []
+    # Extract building way IDs and their coordinates into columns
+    builder = BuildingStoreBuilder()
     for element in data['elements']:
         if element['type'] == 'way' and 'tags' in element and 'building' in element['tags'] and 'center' in element:
-            building_info = {
-                'id': element['id'],
-                'lat': element['center']['lat'],
-                'lon': element['center']['lon'],
-                'type': element['tags']['building']
-            }
-            all_buildings.append(building_info)
+            center = element['center']
+            builder.append(element['id'], center['lat'], center['lon'], element['tags']['building'],
+                           element.get('version'), parse_timestamp(element.get('timestamp')))
+    del data
+    all_buildings = builder.build()
+
+    # Drop the buildings between the simplified outline and the exact boundary
+    if polygon is not None:
+        fetched = len(all_buildings)
+        all_buildings = all_buildings.within(polygon)
+        print(f"Kept {len(all_buildings)} of {fetched} buildings inside the city boundary")
+    return all_buildings
+
+def fetch_tags(building_id):
+    """
+    Fetches the street address and height of a building using the Overpass API.
+
+    Parameters:
+        building_id (int): OSM way ID of the building.
+
+    Returns:
+        tuple: The street name and height ('N/A' when unknown or the request failed).
+    """
+    details_query = f"""
+    [out:json][timeout:25];
+    way({building_id});
+    out body;
+    >;
+    out skel qt;
+    """
+    try:
+        response = overpass_pool.get_pool(OVERPASS_ENDPOINTS).query(details_query, stage="overpass_details")
+        response.raise_for_status()  # Check if the request was successful
+        details_data = response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching details for building ID {building_id}: {e}")
+        metrics.record_item("overpass_details", "failed")
+        return 'N/A', 'N/A'
+    except ValueError as e:
+        print(f"Error parsing JSON response for building ID {building_id}: {e}")
+        print(f"Response content: {response.text}")
+        metrics.record_item("overpass_details", "failed")
+        return 'N/A', 'N/A'
+
+    # Extract address and height information
+    metrics.record_item("overpass_details", "ok")
+    if not details_data['elements']:
+        return 'N/A', 'N/A'
+    tags = details_data['elements'][0].get('tags', {})
+    return tags.get('addr:street', 'N/A'), tags.get('height', 'N/A')
+
+def fetch_details(building):
+    """
+    Adds the street address and height of a building using the Overpass API.
+
+    Parameters:
+        building (dict): Building with at least an 'id' key; updated in place.
+
+    Returns:
+        dict: The building with 'addr_street' and 'height' set ('N/A' when unknown or the request failed).
+    """
+    building['addr_street'], building['height'] = fetch_tags(building['id'])
+    return building
+
+def fetch_in_parallel(function, items):
+    """
+    Runs `function` on every item in a thread pool sized for the Overpass endpoints; the shared HTTP client paces the requests.
+
+    Parameters:
+        function (callable): Called with each item.
+        items (list): The items.
+
+    Yields:
+        tuple: Each item and its result, in order of completion.
+    """
+    with ThreadPoolExecutor(max_workers=overpass_pool.get_pool(OVERPASS_ENDPOINTS).max_workers()) as executor:
+        futures = {executor.submit(function, item): item for item in items}
+        metrics.record_queue_depth("overpass_details", len(futures))
+        for completed, future in enumerate(tqdm(as_completed(futures), total=len(futures), desc="Fetching building details"), 1):
+            metrics.record_queue_depth("overpass_details", len(futures) - completed)
+            yield futures[future], future.result()
+
+def fetch_all_details(buildings):
+    """
+    Fetches the details of several buildings in parallel.
+
+    Parameters:
+        buildings (list): Buildings with at least an 'id' key.
+
+    Yields:
+        dict: Each building with its details, in order of completion.
+    """
+    for building, _ in fetch_in_parallel(fetch_details, buildings):
+        yield building
+
+def fetch_store_details(store):
+    """
+    Fills the street name and height columns of a building store in parallel.
+
+    Parameters:
+        store (BuildingStore): The buildings; updated in place.
+    """
+    store.init_details()
+    ids = store.ids.tolist()
+    for index, (addr_street, height) in fetch_in_parallel(lambda index: fetch_tags(ids[index]), range(len(ids))):
+        store.addr_streets[index] = addr_street
+        store.heights[index] = height
+
+def fetch_buildings_in_bbox(south, west, north, east, max_elements=100, index_file=None, polygon=None):
+    """
+    Fetches a random sample of building IDs and their coordinates from OpenStreetMap within a bounding box, categorized by building types.
+
+    Parameters:
+        south (float): Southern latitude of the bounding box.
+        west (float): Western longitude of the bounding box.
+        north (float): Northern latitude of the bounding box.
+        east (float): Eastern longitude of the bounding box.
+        max_elements (int): Maximum number of building elements to fetch.
+        index_file (str): Optional file to save the IDs and versions of all buildings found, for incremental refreshes.
+        polygon (shapely.geometry.base.BaseGeometry): Optional boundary; only buildings inside it are sampled.
+
+    Returns:
+        dict: Dictionary containing lists of dictionaries with building IDs and their coordinates, categorized by building types.
+    """
+    all_buildings = fetch_building_centers(south, west, north, east, polygon)
+    if all_buildings is None:
+        return None
+    if index_file:
+        save_index(all_buildings, index_file)
 
     # Check if we have any buildings
     if not all_buildings:
@@ -101,70 +257,99 @@ def fetch_building_data(city_name, country_name, max_elements=100):
     print(f"Total buildings extracted: {len(all_buildings)}")
 
     # Randomly sample buildings if more than max_elements are fetched
-    if len(all_buildings) > max_elements:
-        sampled_buildings = random.sample(all_buildings, max_elements)
-    else:
-        sampled_buildings = all_buildings
-
-    def fetch_details(building):
-        building_id = building['id']
-        details_query = f"""
-        [out:json][timeout:25];
-        way({building_id});
-        out body;
-        >;
-        out skel qt;
-        """
-        try:
-            response = requests.get("http://overpass-api.de/api/interpreter", params={'data': details_query})
-            response.raise_for_status()  # Check if the request was successful
-            details_data = response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching details for building ID {building_id}: {e}")
-            return building
-        except ValueError as e:
-            print(f"Error parsing JSON response for building ID {building_id}: {e}")
-            print(f"Response content: {response.text}")
-            return building
-
-        # Extract address and height information
-        if details_data['elements']:
-            element = details_data['elements'][0]
-            building['addr_street'] = element['tags'].get('addr:street', 'N/A')
-            building['height'] = element['tags'].get('height', 'N/A')
-        else:
-            building['addr_street'] = 'N/A'
-            building['height'] = 'N/A'
-        return building
+    sampled_buildings = all_buildings.sample(max_elements)
+    del all_buildings
 
     # Fetch details for each sampled building in parallel
-    building_data = {
-        "yes": [],
-        "house": [],
-        "commercial": []
+    fetch_store_details(sampled_buildings)
+    return categorize_store(sampled_buildings)
+
+def building_record(building):
+    """
+    Builds the record saved to the dataset for a building.
+
+    Parameters:
+        building (dict): Building with 'id', 'lat', 'lon', 'type', 'addr_street' and 'height' keys.
+
+    Returns:
+        dict: The dataset record.
+    """
+    return {
+        'id': building['id'],
+        'lat': building['lat'],
+        'lon': building['lon'],
+        'addr_street': building['addr_street'],
+        'height': building['height'],
+        'building_type': building['type'],
+        'version': building.get('version'),
+        'timestamp': building.get('timestamp')
+    }
+
+def categorize_building(building_data, building):
+    """
+    Adds a building to the list for its type if that type is collected.
+
+    Parameters:
+        building_data (dict): Lists of building records keyed by building type.
+        building (dict): Building with 'id', 'lat', 'lon', 'type', 'addr_street' and 'height' keys.
+    """
+    if building['type'] in building_data:
+        building_data[building['type']].append(building_record(building))
+
+def fetch_building_data(city_name, country_name, max_elements=100, index_file=None):
+    """
+    Fetches a random sample of building IDs and their coordinates from OpenStreetMap within a specified city, categorized by building types.
+
+    Parameters:
+        city_name (str): Name of the city to fetch the building data for.
+        country_name (str): Name of the country to fetch the building data for.
+        max_elements (int): Maximum number of building elements to fetch.
+        index_file (str): Optional file to save the IDs and versions of all buildings found, for incremental refreshes.
+
+    Returns:
+        dict: Dictionary containing lists of dictionaries with building IDs and their coordinates, categorized by building types.
+    """
+    # Fetch bounding box and boundary polygon for the city
+    boundary = fetch_city_boundary(city_name, country_name)
+    if boundary is None:
+        print(f"Failed to fetch bounding box for city: {city_name} in country: {country_name}")
+        return None
+    (south, west, north, east), polygon = boundary
+    return fetch_buildings_in_bbox(south, west, north, east, max_elements, index_file, polygon)
+
+def categorize_store(buildings):
+    """
+    Splits a building store into lists of dataset records by building type, dropping other types.
+
+    Parameters:
+        buildings (BuildingStore): The buildings.
+
+    Returns:
+        dict: Lists of records as built by `building_record`, keyed by building type.
+    """
+    return {building_type: list(store.records()) for building_type, store in buildings.bucket(BUILDING_TYPES).items()}
+
+def dataset_filename(city_name, country_name, max_elements):
+    return f"Data/{city_name}_{country_name}_{max_elements}.jsonl"
+
+def index_filename(dataset_file):
+    return os.path.splitext(dataset_file)[0] + "_index.json"
+
+def save_index(buildings, filename):
+    """
+    Saves the IDs and versions of all buildings found in a harvest, so a later refresh can tell which buildings are new.
+
+    Parameters:
+        buildings (BuildingStore): All buildings found.
+        filename (str): Path of the index file.
+    """
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    index = {
+        'harvested_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'buildings': buildings.version_index()
     }
-    with ThreadPoolExecutor(max_workers=5) as executor:  # Reduce the number of concurrent requests
-        futures = [executor.submit(fetch_details, building) for building in sampled_buildings]
-        for future in tqdm(as_completed(futures), total=len(futures), desc="Fetching building details"):
-            building = future.result()
-            building_type = building['type']
-            building_info = {
-                'id': building['id'],
-                'lat': building['lat'],
-                'lon': building['lon'],
-                'addr_street': building['addr_street'],
-                'height': building['height'],
-                'building_type': building_type
-            }
-            if building_type == 'yes':
-                building_data["yes"].append(building_info)
-            elif building_type == 'house':
-                building_data["house"].append(building_info)
-            elif building_type == 'commercial':
-                building_data["commercial"].append(building_info)
-            time.sleep(0.5)  # Add a delay between requests to avoid hitting rate limits
-
-    return building_data
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
 
 def save_to_jsonl(data, city_name, country_name, max_elements):
     """
@@ -176,7 +361,7 @@ def save_to_jsonl(data, city_name, country_name, max_elements):
         country_name (str): Name of the country.
         max_elements (int): Maximum number of building elements.
     """
-    filename = f"Data/{city_name}_{country_name}_{max_elements}.jsonl"
+    filename = dataset_filename(city_name, country_name, max_elements)
     os.makedirs(os.path.dirname(filename), exist_ok=True)
     with open(filename, 'w', encoding='utf-8') as f:
         for btype, buildings in data.items():
@@ -186,6 +371,7 @@ def save_to_jsonl(data, city_name, country_name, max_elements):
     print(f"Data saved to {filename}")
 
 if __name__ == "__main__":
+    metrics.configure_from_env()
     if len(sys.argv) != 4:
         print("Usage: python building_data_fetcher.py <city_name> <country_name> <max_elements>")
         sys.exit(1)
@@ -194,6 +380,7 @@ if __name__ == "__main__":
     country_name = sys.argv[2]
     max_elements = int(sys.argv[3])
 
-    building_data = fetch_building_data(city_name, country_name, max_elements)
+    index_file = index_filename(dataset_filename(city_name, country_name, max_elements))
+    building_data = fetch_building_data(city_name, country_name, max_elements, index_file)
     if building_data:
         save_to_jsonl(building_data, city_name, country_name, max_elements)
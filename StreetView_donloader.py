@@ -2,55 +2,86 @@ import json
 import os
 import sys
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
+import http_client
+import metrics
 
-def download_street_views(jsonl_path, api_key):
+STREETVIEW_URL = "https://maps.googleapis.com/maps/api/streetview"
+
+def download_street_view(location, api_key, save_folder):
+    """
+    Downloads the Google Street View image for one location.
+
+    Parameters:
+        location (dict): Location with 'id', 'lat' and 'lon' keys.
+        api_key (str): Google Maps API key.
+        save_folder (str): Folder to save the image to.
+
+    Returns:
+        bool: Whether the image was saved.
+    """
+    # Set API call parameters
+    params = {
+        'size': '600x300',
+        'radius': 30,
+        'key': api_key,
+        'location': f"{location['lat']},{location['lon']}"
+    }
+
+    # Send request to Google Street View API
+    try:
+        response = http_client.get(STREETVIEW_URL, stage="streetview", params=params, stream=True)
+    except requests.exceptions.RequestException as e:
+        print(f"\nFailed to fetch image for location {location['id']}: {e}")
+        metrics.record_item("streetview", "failed")
+        return False
+
+    with response:
+        if response.status_code != 200:
+            print(f"\nFailed to fetch image for location {location['id']}. Status code: {response.status_code}")
+            metrics.record_item("streetview", "failed")
+            return False
+        image_path = os.path.join(save_folder, f"{location['id']}.jpg")
+        with open(image_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                f.write(chunk)
+    print(f"\nImage saved for Location {location['id']} - {image_path}")
+    metrics.record_item("streetview", "ok")
+    return True
+
+def download_street_views(jsonl_path, api_key, save_folder=None):
     """
     Downloads Google Street View images based on locations from a JSONL file.
 
     Parameters:
         jsonl_path (str): Path to the JSONL file containing locations.
         api_key (str): Google Maps API key.
+        save_folder (str): Folder to save the images to; defaults to a subfolder named after the JSONL file.
     """
     # Create subfolder based on JSONL filename
-    base_folder = "GoogleStreetViewImages"
-    jsonl_filename = os.path.basename(jsonl_path).split('.')[0]
-    save_folder = os.path.join(base_folder, jsonl_filename)
+    if save_folder is None:
+        base_folder = "GoogleStreetViewImages"
+        jsonl_filename = os.path.basename(jsonl_path).split('.')[0]
+        save_folder = os.path.join(base_folder, jsonl_filename)
     if not os.path.exists(save_folder):
         os.makedirs(save_folder)
 
-    base_url = "https://maps.googleapis.com/maps/api/streetview"
-    params = {
-        'size': '600x300',
-        'radius': 30,
-        'key': api_key
-    }
-
     # Read JSONL file
     with open(jsonl_path, 'r') as file:
         locations = [json.loads(line) for line in file]
+    locations = [location for location in locations if not location.get('deleted')]
 
-    pbar = tqdm(total=len(locations), desc="Downloading Street Views")
-    for location in locations:
-        # Set API call parameters
-        params['location'] = f"{location['lat']},{location['lon']}"
-
-        # Send request to Google Street View API
-        response = requests.get(base_url, params=params, stream=True)
-
-        if response.status_code == 200:
-            image_path = os.path.join(save_folder, f"{location['id']}.jpg")
-            with open(image_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            print(f"\nImage saved for Location {location['id']} - {image_path}")
-        else:
-            print(f"\nFailed to fetch image for location {location['id']}. Status code: {response.status_code}")
-
-        pbar.update(1)
-    pbar.close()
+    # Download in parallel; the shared HTTP client adapts the number of requests in flight
+    with ThreadPoolExecutor(max_workers=http_client.max_workers(STREETVIEW_URL)) as executor:
+        futures = [executor.submit(download_street_view, location, api_key, save_folder) for location in locations]
+        metrics.record_queue_depth("streetview", len(futures))
+        for completed, future in enumerate(tqdm(as_completed(futures), total=len(futures), desc="Downloading Street Views"), 1):
+            metrics.record_queue_depth("streetview", len(futures) - completed)
+            future.result()
 
 if __name__ == "__main__":
+    metrics.configure_from_env()
     if len(sys.argv) != 3:
         print("Usage: python StreetView_downloader.py <jsonl_path> <api_key>")
         sys.exit(1)
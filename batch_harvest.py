@@ -0,0 +1,444 @@
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+from tqdm import tqdm
+import http_client
+import metrics
+import overpass_pool
+import Overpass
+from Overpass import BUILDING_TYPES, categorize_building, fetch_building_centers, fetch_details, index_filename, save_index
+from incremental_refresh import write_jsonl
+
+def read_jsonl(file_path):
+    """
+    Reads the records of a JSONL file, skipping a last line cut off by an interrupted batch.
+
+    Parameters:
+        file_path (str): Path to the JSONL file.
+
+    Returns:
+        list: List of records, empty if the file does not exist.
+    """
+    records = []
+    if os.path.exists(file_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return records
+
+class FairQueue:
+    """
+    Task queue that serves cities in round robin, so a city with many pending tasks cannot starve the others.
+
+    Each city has its own FIFO queue; `get` takes one task from the city at the head of the rotation and moves that
+    city to the back while it still has tasks.
+    """
+    def __init__(self):
+        self.queues = OrderedDict()
+        self.size = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, city, task):
+        with self.condition:
+            self.queues.setdefault(city, deque()).append(task)
+            self.size += 1
+            self.condition.notify()
+
+    def get(self):
+        """
+        Waits for the next task.
+
+        Returns:
+            object: The task, or None once the queue is closed and empty.
+        """
+        with self.condition:
+            while not self.queues and not self.closed:
+                self.condition.wait()
+            if not self.queues:
+                return None
+            city, tasks = self.queues.popitem(last=False)
+            task = tasks.popleft()
+            if tasks:
+                self.queues[city] = tasks
+            self.size -= 1
+            return task
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+class StageWorkers:
+    """
+    Worker threads for one pipeline stage, fed by a fair queue shared by all cities.
+
+    Parameters:
+        name (str): Stage name used to label metrics.
+        workers (int): Number of worker threads; the shared HTTP client limits the requests actually in flight.
+    """
+    def __init__(self, name, workers):
+        self.name = name
+        self.queue = FairQueue()
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(max(1, workers))]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, job, function, *args):
+        self.queue.put(job.name, (job, function, args))
+        metrics.record_queue_depth(self.name, self.queue.size)
+
+    def run(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            metrics.record_queue_depth(self.name, self.queue.size)
+            job, function, args = task
+            if job.failed:
+                continue
+            try:
+                function(*args)
+            except Exception as e:
+                job.fail(e)
+
+    def close(self):
+        self.queue.close()
+        for thread in self.threads:
+            thread.join()
+
+class CityJob:
+    """
+    Harvest of one manifest entry, advanced stage by stage by the batch scheduler and checkpointed for resume.
+
+    Parameters:
+        entry (dict): Manifest entry with either 'city' and 'country' or 'bbox' ([south, west, north, east]), and
+            optionally 'name' and 'max_elements'.
+        scheduler (BatchScheduler): The scheduler running the job.
+    """
+    def __init__(self, entry, scheduler):
+        self.entry = entry
+        self.scheduler = scheduler
+        self.max_elements = int(entry.get('max_elements', 100))
+        if 'bbox' in entry:
+            south, west, north, east = (float(value) for value in entry['bbox'])
+            self.bbox = (south, west, north, east)
+            self.name = entry.get('name') or f"bbox_{south}_{west}_{north}_{east}"
+            self.dataset_file = f"Data/{self.name}_{self.max_elements}_{south}_{west}_{north}_{east}.jsonl"
+        else:
+            self.bbox = None
+            self.name = entry.get('name') or f"{entry['city']}_{entry['country']}"
+            self.dataset_file = Overpass.dataset_filename(entry['city'], entry['country'], self.max_elements)
+        base_name = os.path.splitext(os.path.basename(self.dataset_file))[0]
+        self.checkpoint_file = os.path.splitext(self.dataset_file)[0] + "_checkpoint.json"
+        # The sample is written once; detailed buildings are appended as they finish so progress costs O(1) per building
+        self.sampled_file = os.path.splitext(self.dataset_file)[0] + "_sampled.jsonl"
+        self.progress_file = os.path.splitext(self.dataset_file)[0] + "_details.jsonl"
+        self.image_folder = os.path.join("GoogleStreetViewImages", base_name)
+        self.label_file = os.path.join("Data", f"{base_name}_label.jsonl")
+        self.failed_log_file = os.path.splitext(self.label_file)[0] + "_failed.txt"
+        self.result_file = os.path.join("result", f"{base_name}.jsonl")
+        self.state = {'stage': "centers", 'sampled': 0, 'detailed': 0}
+        self.progress = None
+        self.remaining = 0
+        self.since_checkpoint = 0
+        self.failed = False
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def load_checkpoint(self):
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+            if isinstance(self.state['sampled'], list):
+                # Checkpoints of earlier versions hold the whole sample, with addresses on the detailed buildings
+                sampled = self.state['sampled']
+                write_jsonl(sampled, self.sampled_file)
+                write_jsonl([building for building in sampled if 'addr_street' in building], self.progress_file)
+                self.state.update(sampled=len(sampled), detailed=sum('addr_street' in building for building in sampled))
+                self.save_checkpoint()
+
+    def save_checkpoint(self):
+        os.makedirs(os.path.dirname(self.checkpoint_file) or '.', exist_ok=True)
+        temp_file = self.checkpoint_file + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        # Replace atomically so an interrupted batch never leaves a truncated checkpoint
+        os.replace(temp_file, self.checkpoint_file)
+
+    def set_stage(self, stage):
+        self.state['stage'] = stage
+        self.save_checkpoint()
+        print(f"{self.name}: {stage}")
+
+    def start(self):
+        """Resumes the job from its checkpoint."""
+        self.load_checkpoint()
+        stage = self.state['stage']
+        if stage == "done":
+            print(f"{self.name}: already harvested, see {self.dataset_file}")
+            self.finish()
+        elif stage == "details":
+            self.start_details()
+        elif stage in ("images", "annotate"):
+            # Downloads that failed after their retries are tried again; images already saved are skipped
+            self.start_images()
+        elif self.bbox is not None:
+            self.scheduler.stages['overpass'].submit(self, self.fetch_centers, self.bbox, None)
+        else:
+            self.scheduler.stages['nominatim'].submit(self, self.fetch_boundary)
+
+    def fan_out(self, stage, function, items, then):
+        """
+        Runs `function` on every item in a stage's workers and calls `then` once all of them have finished.
+
+        Parameters:
+            stage (str): Name of the stage whose workers run the items.
+            function (callable): Called with each item.
+            items (list): The items.
+            then (callable): Called without arguments after the last item.
+        """
+        if not items:
+            then()
+            return
+        self.remaining = len(items)
+
+        def run(item):
+            function(item)
+            with self.lock:
+                self.remaining -= 1
+                last = self.remaining == 0
+            if last:
+                then()
+
+        for item in items:
+            self.scheduler.stages[stage].submit(self, run, item)
+
+    def fetch_boundary(self):
+        boundary = Overpass.fetch_city_boundary(self.entry['city'], self.entry['country'])
+        if boundary is None:
+            raise RuntimeError(f"Failed to fetch bounding box for city: {self.entry['city']} in country: {self.entry['country']}")
+        bbox, polygon = boundary
+        self.scheduler.stages['overpass'].submit(self, self.fetch_centers, bbox, polygon)
+
+    def fetch_centers(self, bbox, polygon):
+        all_buildings = fetch_building_centers(*bbox, polygon=polygon)
+        if all_buildings is None:
+            raise RuntimeError("Failed to fetch building centers")
+        save_index(all_buildings, index_filename(self.dataset_file))
+        if not all_buildings:
+            print(f"{self.name}: no buildings found")
+            self.finish()
+            return
+        sampled = all_buildings.sample(self.max_elements)
+        write_jsonl(sampled, self.sampled_file)
+        if os.path.exists(self.progress_file):
+            os.remove(self.progress_file)
+        self.state.update(sampled=len(sampled), detailed=0)
+        self.set_stage("details")
+        self.start_details()
+
+    def start_details(self):
+        sampled = read_jsonl(self.sampled_file)
+        # Buildings detailed before an interruption are already in the progress file
+        detailed = {building['id'] for building in read_jsonl(self.progress_file)}
+        pending = [building for building in sampled if building['id'] not in detailed]
+        self.state['detailed'] = len(sampled) - len(pending)
+        self.progress = open(self.progress_file, 'a', encoding='utf-8')
+        self.fan_out('overpass', self.fetch_details, pending, self.finish_details)
+
+    def fetch_details(self, building):
+        detailed = fetch_details(building)
+        line = json.dumps(detailed, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.progress.write(line)
+            self.progress.flush()
+            self.state['detailed'] += 1
+            self.since_checkpoint += 1
+            if self.since_checkpoint >= self.scheduler.checkpoint_every:
+                self.since_checkpoint = 0
+                self.save_checkpoint()
+
+    def finish_details(self):
+        self.progress.close()
+        self.progress = None
+        detailed = {building['id']: building for building in read_jsonl(self.progress_file)}
+        building_data = {building_type: [] for building_type in BUILDING_TYPES}
+        for building in read_jsonl(self.sampled_file):
+            categorize_building(building_data, detailed[building['id']])
+        os.makedirs(os.path.dirname(self.dataset_file), exist_ok=True)
+        with open(self.dataset_file, 'w', encoding='utf-8') as f:
+            for buildings in building_data.values():
+                for building in buildings:
+                    json.dump(building, f, ensure_ascii=False)
+                    f.write('\n')
+        print(f"Data saved to {self.dataset_file}")
+        self.set_stage("images")
+        os.remove(self.sampled_file)
+        os.remove(self.progress_file)
+        self.start_images()
+
+    def start_images(self):
+        if not self.scheduler.api_key:
+            self.finish()
+            return
+        from StreetView_donloader import download_street_view
+        os.makedirs(self.image_folder, exist_ok=True)
+        with open(self.dataset_file, 'r', encoding='utf-8') as f:
+            locations = [json.loads(line) for line in f if line.strip()]
+        pending = [location for location in locations if not location.get('deleted')
+                   and not os.path.exists(os.path.join(self.image_folder, f"{location['id']}.jpg"))]
+        self.fan_out('streetview', lambda location: download_street_view(location, self.scheduler.api_key, self.image_folder),
+                     pending, self.finish_images)
+
+    def finish_images(self):
+        self.set_stage("annotate")
+        self.start_annotation()
+
+    def start_annotation(self):
+        if not (self.scheduler.prompt and self.scheduler.api_keys):
+            self.finish()
+            return
+        from openai import normalize_id
+        labelled = set()
+        if os.path.exists(self.label_file):
+            with open(self.label_file, 'r', encoding='utf-8') as f:
+                labelled = {normalize_id(json.loads(line)['id']) for line in f if line.strip()}
+        pending = [os.path.join(self.image_folder, name) for name in sorted(os.listdir(self.image_folder))
+                   if name.endswith('.jpg') and name[:-len('.jpg')] not in labelled] if os.path.isdir(self.image_folder) else []
+        self.fan_out('openai', self.annotate, pending, self.finish_annotation)
+
+    def annotate(self, image_path):
+        from openai import normalize_id, process_single_image
+        scheduler = self.scheduler
+        image_id = normalize_id(os.path.basename(image_path)[:-len('.jpg')])
+        result, key_index = process_single_image(image_path, scheduler.api_keys, scheduler.request_counters, scheduler.prompt)
+        with self.lock:
+            if result:
+                with open(self.label_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({"id": image_id, "content": result}) + "\n")
+                metrics.record_item("openai", "ok")
+            else:
+                print(f"Failed to process image {image_id} with API key {key_index}")
+                with open(self.failed_log_file, 'a', encoding='utf-8') as f:
+                    f.write(image_path + "\n")
+                metrics.record_item("openai", "failed")
+
+    def finish_annotation(self):
+        from image_processing_pipeline import merge_jsonl_files
+        if os.path.exists(self.label_file):
+            os.makedirs(os.path.dirname(self.result_file), exist_ok=True)
+            merge_jsonl_files(self.dataset_file, self.label_file, self.result_file)
+        self.finish()
+
+    def finish(self):
+        if self.state['stage'] != "done":
+            self.set_stage("done")
+        metrics.record_item("batch", "ok")
+        self.done.set()
+
+    def fail(self, error):
+        with self.lock:
+            if self.failed:
+                return
+            self.failed = True
+        print(f"{self.name}: failed in stage {self.state['stage']}: {error}; rerun the batch to resume")
+        metrics.record_item("batch", "failed")
+        self.done.set()
+
+class BatchScheduler:
+    """
+    Runs the stages of many city harvests in one process.
+
+    Every stage has one pool of workers fed by a fair queue, so all cities share the HTTP client's connection pools
+    and adaptive rate limits, and each city gets its turn at every stage regardless of how many buildings the
+    others have queued.
+
+    Parameters:
+        api_key (str): Google Maps API key, or None to stop after the building data.
+        prompt_file (str): Prompt file for the annotation, or None to skip it.
+        api_keys_file (str): File containing the OpenAI API keys, or None to skip the annotation.
+        checkpoint_every (int): Number of building details fetched between updates of a city's checkpoint counts.
+    """
+    def __init__(self, api_key=None, prompt_file=None, api_keys_file=None, checkpoint_every=50):
+        from openai import OPENAI_URL, load_api_keys, load_prompt
+        from StreetView_donloader import STREETVIEW_URL
+        self.api_key = api_key
+        self.prompt = load_prompt(prompt_file) if prompt_file else None
+        self.api_keys = load_api_keys(api_keys_file) if api_keys_file else None
+        # One usage counter per OpenAI key, shared by all cities
+        self.request_counters = {i: 0 for i in range(len(self.api_keys or []))}
+        self.checkpoint_every = checkpoint_every
+        self.stages = {
+            'nominatim': StageWorkers("nominatim", http_client.max_workers(Overpass.NOMINATIM_URL)),
+            'overpass': StageWorkers("overpass", overpass_pool.get_pool(Overpass.OVERPASS_ENDPOINTS).max_workers()),
+            'streetview': StageWorkers("streetview", http_client.max_workers(STREETVIEW_URL) if api_key else 0),
+            'openai': StageWorkers("openai", http_client.max_workers(OPENAI_URL) if self.api_keys else 0),
+        }
+
+    def run(self, entries):
+        """
+        Harvests every manifest entry, resuming each from its checkpoint.
+
+        Parameters:
+            entries (list): Manifest entries.
+
+        Returns:
+            list: The jobs, with `failed` set for those that did not finish.
+        """
+        jobs = [CityJob(entry, self) for entry in entries]
+        # Checkpoints, progress and label files are named after the dataset, so two jobs writing it would clash
+        dataset_files = [job.dataset_file for job in jobs]
+        duplicates = sorted({name for name in dataset_files if dataset_files.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"Manifest entries must harvest distinct datasets; repeated: {', '.join(duplicates)}")
+        for job in jobs:
+            job.start()
+        for job in tqdm(jobs, desc="Harvesting cities"):
+            job.done.wait()
+        for stage in self.stages.values():
+            stage.close()
+        return jobs
+
+def load_manifest(manifest_file):
+    """
+    Reads a batch manifest with one JSON object per line.
+
+    Parameters:
+        manifest_file (str): Path to the manifest, e.g. lines like {"city": "Paris", "country": "France", "max_elements": 500}
+            or {"name": "Midtown", "bbox": [40.75, -74.0, 40.76, -73.98]}.
+
+    Returns:
+        list: The manifest entries.
+    """
+    entries = []
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if 'bbox' not in entry and not ('city' in entry and 'country' in entry):
+                    raise ValueError(f"Manifest entry needs 'city' and 'country' or 'bbox': {line.strip()}")
+                entries.append(entry)
+    return entries
+
+if __name__ == "__main__":
+    metrics.configure_from_env()
+    parser = argparse.ArgumentParser(description='Harvest building data for many cities in one process.')
+    parser.add_argument('manifest', type=str, help='JSONL file with one city or bounding box per line.')
+    parser.add_argument('--api_key', type=str, help='Google Maps API key to download Street View images.')
+    parser.add_argument('--prompt_file', type=str, help='Prompt file to annotate the downloaded images.')
+    parser.add_argument('--api_keys_file', type=str, help='File containing the OpenAI API keys.')
+    parser.add_argument('--checkpoint_every', type=int, default=50, help='Building details fetched between checkpoint updates.')
+
+    args = parser.parse_args()
+    scheduler = BatchScheduler(args.api_key, args.prompt_file, args.api_keys_file, args.checkpoint_every)
+    jobs = scheduler.run(load_manifest(args.manifest))
+    failed = [job.name for job in jobs if job.failed]
+    print(f"Harvested {len(jobs) - len(failed)} of {len(jobs)} entries")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
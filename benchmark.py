@@ -0,0 +1,565 @@
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import http_client
+from city_boundary import boundary_from_geojson, points_in_polygon
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(REPO_DIR, "benchmark_fixtures")
+
+STAGES = [
+    "fetch_building_data",
+    "download_street_views",
+    "process_directory",
+    "merge_jsonl_files",
+    "export_to_formats",
+]
+DEFAULT_SCALES = [1000, 10000, 100000]
+
+# Each stubbed service gets its own port and the concurrency limit and request interval of the real host
+SERVICE_HOSTS = {
+    "nominatim": "nominatim.openstreetmap.org",
+    "overpass": "overpass-api.de",
+    "streetview": "maps.googleapis.com",
+    "openai": "api.openai.com",
+}
+
+def load_fixture(name):
+    """
+    Loads a recorded JSON response from the benchmark fixture directory.
+
+    Parameters:
+        name (str): File name of the fixture.
+
+    Returns:
+        object: The decoded JSON fixture.
+    """
+    with open(os.path.join(FIXTURE_DIR, name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def percentile(values, pct):
+    """
+    Returns the nearest-rank percentile of a list of values.
+
+    Parameters:
+        values (list): Values to summarize.
+        pct (float): Percentile between 0 and 100.
+
+    Returns:
+        float: The percentile value, or None if the list is empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+class StubBehaviour:
+    """
+    Fault injection settings and shared state for the stub servers.
+
+    Parameters:
+        latency_ms (float): Mean added latency per response in milliseconds.
+        jitter_ms (float): Uniform jitter applied around the mean latency.
+        rate_limit (float): Requests per second allowed before answering 429 (0 disables).
+        error_rate (float): Probability of answering a request with a 503.
+        image_bytes (int): Size of the Street View image payload.
+        seed (int): Seed for the random number generator.
+    """
+    def __init__(self, latency_ms=50.0, jitter_ms=10.0, rate_limit=0.0, error_rate=0.0, image_bytes=8192, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.image = bytes(random.Random(seed).getrandbits(8) for _ in range(image_bytes))
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = rate_limit
+        self.last_refill = time.monotonic()
+        self.nominatim = load_fixture("nominatim_search.json")
+        self.overpass_center = load_fixture("overpass_center.json")
+        self.overpass_details = load_fixture("overpass_way_details.json")
+        self.openai_completion = load_fixture("openai_chat_completion.json")
+        self.scaled_centers = {}
+
+    def take_token(self):
+        """Consumes one token from the rate limit bucket, returning False when it is empty."""
+        if not self.rate_limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.last_refill) * self.rate_limit)
+            self.last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def should_fail(self):
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+    def delay(self):
+        with self.lock:
+            jitter = self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(0.0, self.latency_ms + jitter) / 1000.0)
+
+    def centers_for(self, count):
+        """
+        Builds an Overpass `out center` response with `count` buildings by replaying the recorded elements.
+
+        Centers are drawn inside the recorded city polygon, so that none of them is dropped by the boundary filter
+        and every case processes `count` buildings.
+
+        Parameters:
+            count (int): Number of building elements to return.
+
+        Returns:
+            bytes: The encoded JSON response body.
+        """
+        with self.lock:
+            if count in self.scaled_centers:
+                return self.scaled_centers[count]
+            rng = random.Random(count)
+            south, north, west, east = (float(v) for v in self.nominatim[0]['boundingbox'])
+            boundary = boundary_from_geojson(self.nominatim[0].get('geojson'))
+            centers = []
+            while len(centers) < count:
+                lats = [rng.uniform(south, north) for _ in range(count)]
+                lons = [rng.uniform(west, east) for _ in range(count)]
+                inside = points_in_polygon(lats, lons, boundary) if boundary is not None else [True] * count
+                centers.extend((lat, lon) for lat, lon, keep in zip(lats, lons, inside) if keep)
+            recorded = self.overpass_center['elements']
+            elements = []
+            for i, (lat, lon) in enumerate(centers[:count]):
+                template = recorded[i % len(recorded)]
+                element = dict(template)
+                element['id'] = 1000000000 + i
+                element['center'] = {'lat': lat, 'lon': lon}
+                elements.append(element)
+            response = dict(self.overpass_center, elements=elements)
+            body = json.dumps(response).encode('utf-8')
+            self.scaled_centers[count] = body
+            return body
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Replays recorded Nominatim, Overpass, Street View and OpenAI responses."""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def inject_faults(self):
+        behaviour = self.server.behaviour
+        if not behaviour.take_token():
+            self.send_body(429, b'{"error": "rate limited"}', headers={"Retry-After": "1"})
+            return True
+        behaviour.delay()
+        if behaviour.should_fail():
+            self.send_body(503, b'{"error": "service unavailable"}')
+            return True
+        return False
+
+    def do_GET(self):
+        behaviour = self.server.behaviour
+        url = urlparse(self.path)
+        if self.inject_faults():
+            return
+        if url.path == "/nominatim/search":
+            self.send_body(200, json.dumps(behaviour.nominatim).encode('utf-8'))
+            return
+        if re.match(r"^/overpass/\d+/api/status$", url.path):
+            self.send_body(200, b"Connected as: 0\nRate limit: 0\n4 slots available now.\n", content_type="text/plain")
+            return
+        if self.send_overpass(url.path, parse_qs(url.query).get('data', [''])[0]):
+            return
+        if url.path == "/streetview":
+            self.send_body(200, behaviour.image, content_type="image/jpeg")
+            return
+        self.send_body(404, b'{"error": "not found"}')
+
+    def send_overpass(self, path, query):
+        behaviour = self.server.behaviour
+        match = re.match(r"^/overpass/(\d+)/api/interpreter$", path)
+        if not match:
+            return False
+        if "out center" in query:
+            self.send_body(200, behaviour.centers_for(int(match.group(1))))
+            return True
+        way = re.search(r"way\((\d+)\)", query)
+        details = json.loads(json.dumps(behaviour.overpass_details))
+        if way:
+            details['elements'][0]['id'] = int(way.group(1))
+        self.send_body(200, json.dumps(details).encode('utf-8'))
+        return True
+
+    def do_POST(self):
+        behaviour = self.server.behaviour
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if self.inject_faults():
+            return
+        path = urlparse(self.path).path
+        if path.startswith("/overpass/"):
+            query = parse_qs(body.decode('utf-8')).get('data', [''])[0]
+            if self.send_overpass(path, query):
+                return
+        if path == "/openai/v1/chat/completions":
+            self.send_body(200, json.dumps(behaviour.openai_completion).encode('utf-8'))
+            return
+        self.send_body(404, b'{"error": "not found"}')
+
+class StubServer(ThreadingHTTPServer):
+    # The listen backlog is taken from the class when the socket is bound, so it must be set here
+    request_queue_size = 256
+    daemon_threads = True
+
+def start_stub_server(behaviour):
+    """
+    Starts the stub server on an ephemeral local port in a background thread.
+
+    Parameters:
+        behaviour (StubBehaviour): Fault injection settings.
+
+    Returns:
+        tuple: The server instance and its base URL.
+    """
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    server.behaviour = behaviour
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def start_stub_servers(behaviour):
+    """
+    Starts one stub server per service, so the HTTP client keeps a separate limiter for each as it does in production.
+
+    Parameters:
+        behaviour (StubBehaviour): Fault injection settings shared by the servers.
+
+    Returns:
+        tuple: The server instances and a dict mapping service names to their base URLs.
+    """
+    servers = []
+    base_urls = {}
+    for service in SERVICE_HOSTS:
+        server, base_urls[service] = start_stub_server(behaviour)
+        servers.append(server)
+    return servers, base_urls
+
+def apply_host_limits(base_urls, max_concurrency=None):
+    """
+    Gives each stub host the concurrency limit and request interval of the real host it stands in for.
+
+    Parameters:
+        base_urls (dict): Base URLs of the stub servers keyed by service.
+        max_concurrency (dict): Optional limits keyed by service that override the production ones.
+    """
+    for service, base_url in base_urls.items():
+        real_host = SERVICE_HOSTS[service]
+        stub_host = urlparse(base_url).netloc
+        limit = (max_concurrency or {}).get(service, http_client.DEFAULT_HOST_LIMITS[real_host])
+        http_client.DEFAULT_HOST_INTERVALS[stub_host] = http_client.DEFAULT_HOST_INTERVALS.get(real_host, 0.0)
+        http_client.set_host_limit(stub_host, limit)
+
+def write_locations(path, count):
+    """Writes `count` synthetic building records in the format produced by `Overpass.py`."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rng = random.Random(count)
+    types = ["yes", "house", "commercial"]
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(count):
+            record = {
+                'id': 1000000000 + i,
+                'lat': rng.uniform(40.4765780, 40.9176300),
+                'lon': rng.uniform(-74.2588430, -73.7002330),
+                'addr_street': 'Broadway',
+                'height': '54',
+                'building_type': types[i % len(types)]
+            }
+            f.write(json.dumps(record) + '\n')
+
+def write_labels(path, count):
+    """Writes `count` annotation records in the format produced by `openai.py`."""
+    content = load_fixture("openai_chat_completion.json")['choices'][0]['message']['content']
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(count):
+            f.write(json.dumps({"id": str(1000000000 + i), "content": content}) + '\n')
+
+def write_images(directory, count, image_bytes):
+    """Creates `count` image files, hard-linked to a single payload where the file system allows it."""
+    os.makedirs(directory, exist_ok=True)
+    source = os.path.join(directory, "payload.bin")
+    with open(source, 'wb') as f:
+        f.write(os.urandom(image_bytes))
+    for i in range(count):
+        target = os.path.join(directory, f"{1000000000 + i}.jpg")
+        try:
+            os.link(source, target)
+        except OSError:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                dst.write(src.read())
+
+def prepare_stage(stage, scale, base_urls, image_bytes):
+    """
+    Points the stage at the stub server, writes its inputs and returns a callable that runs it.
+
+    Parameters:
+        stage (str): Name of the stage to benchmark.
+        scale (int): Number of buildings, images or records to process.
+        base_urls (dict): Base URLs of the stub servers keyed by service.
+        image_bytes (int): Size of the synthetic image files.
+
+    Returns:
+        callable: Runs the stage when called.
+    """
+    if stage == "fetch_building_data":
+        import Overpass
+        Overpass.NOMINATIM_URL = f"{base_urls['nominatim']}/nominatim/search"
+        Overpass.OVERPASS_ENDPOINTS = [f"{base_urls['overpass']}/overpass/{scale}/api/interpreter"]
+        return lambda: Overpass.fetch_building_data("New York", "United States", scale)
+
+    if stage == "download_street_views":
+        import StreetView_donloader
+        StreetView_donloader.STREETVIEW_URL = f"{base_urls['streetview']}/streetview"
+        jsonl_path = os.path.join("Data", f"bench_{scale}.jsonl")
+        write_locations(jsonl_path, scale)
+        return lambda: StreetView_donloader.download_street_views(jsonl_path, "bench-key")
+
+    if stage == "process_directory":
+        openai_module = __import__("openai")
+        openai_module.OPENAI_URL = f"{base_urls['openai']}/openai/v1/chat/completions"
+        directory = os.path.join("GoogleStreetViewImages", f"bench_{scale}")
+        write_images(directory, scale, image_bytes)
+        os.makedirs("Data", exist_ok=True)
+        with open("prompt.txt", 'w', encoding='utf-8') as f:
+            f.write("Describe the building exterior as JSON.")
+        with open("openai_api_keys.txt", 'w') as f:
+            f.write("sk-bench-0\nsk-bench-1\nsk-bench-2\n")
+        return lambda: openai_module.process_directory(directory, "prompt.txt", "openai_api_keys.txt", "failed.txt")
+
+    if stage == "merge_jsonl_files":
+        import image_processing_pipeline
+        write_locations(os.path.join("Data", "buildings.jsonl"), scale)
+        write_labels(os.path.join("Data", "labels.jsonl"), scale)
+        return lambda: image_processing_pipeline.merge_jsonl_files(
+            os.path.join("Data", "buildings.jsonl"), os.path.join("Data", "labels.jsonl"), "merged.jsonl")
+
+    if stage == "export_to_formats":
+        import export_results
+        import pandas as pd
+        from shapely.geometry import Point
+        jsonl_path = os.path.join("Data", "merged.jsonl")
+        write_locations(jsonl_path, scale)
+        df = pd.DataFrame(export_results.read_jsonl(jsonl_path))
+        df['geometry'] = [Point(xy) for xy in zip(df.lon, df.lat)]
+        return lambda: export_results.export_to_formats(df, os.path.join("export", "bench"), "bench")
+
+    raise ValueError(f"Unknown stage: {stage}")
+
+def run_case(stage, scale, base_urls, image_bytes, max_concurrency, conn):
+    """
+    Runs a single benchmark case in a fresh process and sends its measurements through `conn`.
+
+    Parameters:
+        stage (str): Name of the stage to benchmark.
+        scale (int): Number of items to process.
+        base_urls (dict): Base URLs of the stub servers keyed by service.
+        image_bytes (int): Size of the synthetic image files.
+        max_concurrency (dict): Optional concurrency limits keyed by service, overriding the production ones.
+        conn (multiprocessing.connection.Connection): Pipe to report results on.
+    """
+    result = {'stage': stage, 'scale': scale}
+    latencies = []
+    statuses = {}
+    workdir = tempfile.mkdtemp(prefix=f"bench_{stage}_")
+    try:
+        sys.path.insert(0, REPO_DIR)
+        os.chdir(workdir)
+        try:
+            import requests
+            original_request = requests.Session.request
+
+            def timed_request(session, method, url, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    response = original_request(session, method, url, *args, **kwargs)
+                except Exception:
+                    statuses['error'] = statuses.get('error', 0) + 1
+                    raise
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                return response
+
+            requests.Session.request = timed_request
+        except ImportError:
+            pass
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            apply_host_limits(base_urls, max_concurrency)
+            stage_fn = prepare_stage(stage, scale, base_urls, image_bytes)
+            start = time.perf_counter()
+            stage_fn()
+            elapsed = time.perf_counter() - start
+
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            peak_rss *= 1024
+        result.update({
+            'elapsed_s': elapsed,
+            'throughput_per_s': scale / elapsed if elapsed > 0 else None,
+            'requests': len(latencies),
+            'statuses': {str(k): v for k, v in statuses.items()},
+            'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+            'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+            'peak_rss_mb': peak_rss / (1024 * 1024)
+        })
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+    conn.send(result)
+    conn.close()
+
+def run_benchmarks(stages, scales, behaviour, timeout=None, max_concurrency=None):
+    """
+    Runs every stage at every scale against the stub servers.
+
+    Parameters:
+        stages (list): Stage names to benchmark.
+        scales (list): Item counts to benchmark each stage at.
+        behaviour (StubBehaviour): Fault injection settings for the stub servers.
+        timeout (float): Maximum seconds per case, or None for no limit.
+        max_concurrency (dict): Optional concurrency limits keyed by service, overriding the production ones.
+
+    Returns:
+        list: One result dictionary per case.
+    """
+    servers, base_urls = start_stub_servers(behaviour)
+    os.environ.setdefault("TQDM_DISABLE", "1")
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    try:
+        for stage in stages:
+            for scale in scales:
+                print(f"Running {stage} at {scale}...")
+                parent_conn, child_conn = ctx.Pipe(duplex=False)
+                process = ctx.Process(target=run_case, args=(stage, scale, base_urls, len(behaviour.image),
+                                                                   max_concurrency, child_conn))
+                process.start()
+                child_conn.close()
+                if parent_conn.poll(timeout):
+                    try:
+                        result = parent_conn.recv()
+                    except EOFError:
+                        # The child died without reporting, e.g. killed for running out of memory
+                        process.join()
+                        result = {'stage': stage, 'scale': scale, 'error': f"crashed with exit code {process.exitcode}"}
+                else:
+                    result = {'stage': stage, 'scale': scale, 'error': f"timed out after {timeout}s"}
+                    process.terminate()
+                process.join()
+                results.append(result)
+                print(format_result(result))
+    finally:
+        for server in servers:
+            server.shutdown()
+    return results
+
+def format_result(result):
+    if 'error' in result:
+        return f"  {result['stage']:<22} {result['scale']:>7}  ERROR {result['error']}"
+
+    def ms(value):
+        return f"{value:8.1f}" if value is not None else "       -"
+
+    return (f"  {result['stage']:<22} {result['scale']:>7}  {result['throughput_per_s']:10.1f}/s"
+            f"  p50 {ms(result['p50_ms'])} ms  p99 {ms(result['p99_ms'])} ms"
+            f"  rss {result['peak_rss_mb']:8.1f} MB  statuses {result['statuses']}")
+
+def compare_to_baseline(results, baseline_file, tolerance):
+    """
+    Compares throughput against a previous run and reports regressions.
+
+    Parameters:
+        results (list): Results of the current run.
+        baseline_file (str): JSON file written by a previous run with --output.
+        tolerance (float): Allowed relative throughput drop before a case counts as a regression.
+
+    Returns:
+        list: Descriptions of the regressed cases.
+    """
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = {(r['stage'], r['scale']): r for r in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['stage'], result['scale']))
+        if not previous or 'error' in previous:
+            continue
+        if 'error' in result:
+            regressions.append(f"{result['stage']} at {result['scale']}: {result['error']}")
+            continue
+        drop = 1 - result['throughput_per_s'] / previous['throughput_per_s']
+        if drop > tolerance:
+            regressions.append(f"{result['stage']} at {result['scale']}: throughput "
+                               f"{previous['throughput_per_s']:.1f}/s -> {result['throughput_per_s']:.1f}/s")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the BuildingView pipeline stages against local stub servers.')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help='Stages to benchmark.')
+    parser.add_argument('--scales', nargs='+', type=int, default=DEFAULT_SCALES, help='Item counts to run each stage at.')
+    parser.add_argument('--latency_ms', type=float, default=50.0, help='Mean stub response latency in milliseconds.')
+    parser.add_argument('--jitter_ms', type=float, default=10.0, help='Uniform jitter around the stub latency.')
+    parser.add_argument('--rate_limit', type=float, default=0.0, help='Stub requests per second before 429s (0 disables).')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Fraction of stub requests answered with 503.')
+    parser.add_argument('--image_bytes', type=int, default=8192, help='Size of the Street View image payload.')
+    parser.add_argument('--max_concurrency', type=str,
+                        help='Concurrency limits per service overriding the production ones, e.g. "overpass=8,streetview=64".')
+    parser.add_argument('--timeout', type=float, default=None, help='Maximum seconds per case.')
+    parser.add_argument('--output', type=str, help='File to write the JSON results to.')
+    parser.add_argument('--baseline', type=str, help='Previous --output file to check for throughput regressions.')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed relative throughput drop against the baseline.')
+
+    args = parser.parse_args()
+    max_concurrency = http_client.parse_host_limits(args.max_concurrency)
+    unknown = set(max_concurrency) - set(SERVICE_HOSTS)
+    if unknown:
+        parser.error(f"unknown services in --max_concurrency: {', '.join(sorted(unknown))}")
+    behaviour = StubBehaviour(args.latency_ms, args.jitter_ms, args.rate_limit, args.error_rate, args.image_bytes)
+    results = run_benchmarks(args.stages, args.scales, behaviour, args.timeout, max_concurrency)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,258 @@
+import array
+import calendar
+import random
+import sys
+import time
+import numpy as np
+from city_boundary import points_in_polygon
+
+# Sentinel for unknown versions and timestamps in the integer columns
+MISSING = -1
+
+def parse_timestamp(value):
+    """
+    Converts an OSM timestamp such as "2023-05-01T12:00:00Z" to seconds since the epoch.
+
+    Parameters:
+        value (str): The timestamp, or None.
+
+    Returns:
+        int: Seconds since the epoch, or MISSING.
+    """
+    if not value:
+        return MISSING
+    # Slicing is several times faster than strptime, which matters for millions of buildings
+    return calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                            int(value[11:13]), int(value[14:16]), int(value[17:19])))
+
+def format_timestamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds)) if seconds != MISSING else None
+
+class BuildingStore:
+    """
+    Column store for buildings: NumPy arrays for IDs, coordinates, versions and timestamps, and interned type codes.
+
+    A building costs about 40 bytes here instead of several hundred as a dict, and filtering, sampling and
+    bucketing by type work on whole columns. Indexing or iterating the store gives building dicts with the keys
+    returned by `Overpass.fetch_building_centers`, for code that works on single buildings.
+
+    Parameters:
+        ids (numpy.ndarray): OSM way IDs (int64).
+        lats (numpy.ndarray): Center latitudes (float64).
+        lons (numpy.ndarray): Center longitudes (float64).
+        type_codes (numpy.ndarray): Indexes into `types` (int32).
+        versions (numpy.ndarray): Way versions, MISSING when unknown (int32).
+        timestamps (numpy.ndarray): Edit times in seconds since the epoch, MISSING when unknown (int64).
+        types (list): Building type names; shared by stores derived from this one.
+        addr_streets (list): Optional street names, 'N/A' when unknown.
+        heights (list): Optional heights, 'N/A' when unknown.
+    """
+    __slots__ = ('ids', 'lats', 'lons', 'type_codes', 'versions', 'timestamps', 'types', 'addr_streets', 'heights')
+
+    def __init__(self, ids, lats, lons, type_codes, versions, timestamps, types, addr_streets=None, heights=None):
+        self.ids = ids
+        self.lats = lats
+        self.lons = lons
+        self.type_codes = type_codes
+        self.versions = versions
+        self.timestamps = timestamps
+        self.types = types
+        self.addr_streets = addr_streets
+        self.heights = heights
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        building = {
+            'id': int(self.ids[index]),
+            'lat': float(self.lats[index]),
+            'lon': float(self.lons[index]),
+            'type': self.types[self.type_codes[index]],
+            'version': int(self.versions[index]) if self.versions[index] != MISSING else None,
+            'timestamp': format_timestamp(int(self.timestamps[index]))
+        }
+        if self.addr_streets is not None:
+            building['addr_street'] = self.addr_streets[index]
+            building['height'] = self.heights[index]
+        return building
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in (self.ids, self.lats, self.lons, self.type_codes, self.versions, self.timestamps))
+
+    def take(self, selection):
+        """
+        Selects buildings by position.
+
+        Parameters:
+            selection (numpy.ndarray): Integer positions or a boolean mask.
+
+        Returns:
+            BuildingStore: A new store with the selected buildings, sharing the type table.
+        """
+        positions = np.flatnonzero(selection) if selection.dtype == np.bool_ else selection
+        addr_streets = heights = None
+        if self.addr_streets is not None:
+            addr_streets = [self.addr_streets[i] for i in positions.tolist()]
+            heights = [self.heights[i] for i in positions.tolist()]
+        return BuildingStore(self.ids[positions], self.lats[positions], self.lons[positions], self.type_codes[positions],
+                             self.versions[positions], self.timestamps[positions], self.types, addr_streets, heights)
+
+    def sample(self, count):
+        """
+        Randomly samples buildings, keeping their original order.
+
+        Parameters:
+            count (int): Number of buildings to keep.
+
+        Returns:
+            BuildingStore: The sample, or this store if it has no more than `count` buildings.
+        """
+        if len(self) <= count:
+            return self
+        return self.take(np.sort(np.array(random.sample(range(len(self)), count), dtype=np.int64)))
+
+    def within_bbox(self, south, west, north, east):
+        return self.take((self.lats >= south) & (self.lats <= north) & (self.lons >= west) & (self.lons <= east))
+
+    def within(self, geometry):
+        return self.take(points_in_polygon(self.lats, self.lons, geometry))
+
+    def type_mask(self, building_types):
+        codes = [code for code, name in enumerate(self.types) if name in building_types]
+        return np.isin(self.type_codes, codes)
+
+    def bucket(self, building_types):
+        """
+        Splits the store by building type.
+
+        Parameters:
+            building_types (tuple): Types to keep.
+
+        Returns:
+            dict: Maps each type to a store with its buildings; other types are dropped.
+        """
+        return {building_type: self.take(self.type_mask((building_type,))) for building_type in building_types}
+
+    def version_index(self):
+        versions = [version if version != MISSING else None for version in self.versions.tolist()]
+        return dict(zip((str(building_id) for building_id in self.ids.tolist()), versions))
+
+    def init_details(self):
+        self.addr_streets = ['N/A'] * len(self)
+        self.heights = ['N/A'] * len(self)
+
+    def records(self):
+        """
+        Yields the dataset records of the buildings, as saved by `Overpass.save_to_jsonl`.
+
+        Yields:
+            dict: Records with 'id', 'lat', 'lon', 'addr_street', 'height', 'building_type', 'version' and 'timestamp'.
+        """
+        addr_streets = self.addr_streets or ['N/A'] * len(self)
+        heights = self.heights or ['N/A'] * len(self)
+        columns = zip(self.ids.tolist(), self.lats.tolist(), self.lons.tolist(), addr_streets, heights,
+                      self.type_codes.tolist(), self.versions.tolist(), self.timestamps.tolist())
+        for building_id, lat, lon, addr_street, height, type_code, version, timestamp in columns:
+            yield {
+                'id': building_id,
+                'lat': lat,
+                'lon': lon,
+                'addr_street': addr_street,
+                'height': height,
+                'building_type': self.types[type_code],
+                'version': version if version != MISSING else None,
+                'timestamp': format_timestamp(timestamp)
+            }
+
+    @classmethod
+    def concat(cls, stores):
+        """
+        Joins stores built separately, e.g. in worker processes, merging their type tables.
+
+        Parameters:
+            stores (list): The stores.
+
+        Returns:
+            BuildingStore: One store with the buildings of all stores in order.
+        """
+        type_index = {}
+        type_codes = []
+        for store in stores:
+            remap = np.array([type_index.setdefault(name, len(type_index)) for name in store.types] or [0], dtype=np.int32)
+            type_codes.append(remap[store.type_codes])
+        types = list(type_index)
+        details = stores and all(store.addr_streets is not None for store in stores)
+        addr_streets = [name for store in stores for name in store.addr_streets] if details else None
+        heights = [height for store in stores for height in store.heights] if details else None
+        return cls(np.concatenate([store.ids for store in stores] or [np.empty(0, np.int64)]),
+                   np.concatenate([store.lats for store in stores] or [np.empty(0, np.float64)]),
+                   np.concatenate([store.lons for store in stores] or [np.empty(0, np.float64)]),
+                   np.concatenate(type_codes or [np.empty(0, np.int32)]),
+                   np.concatenate([store.versions for store in stores] or [np.empty(0, np.int32)]),
+                   np.concatenate([store.timestamps for store in stores] or [np.empty(0, np.int64)]),
+                   types, addr_streets, heights)
+
+class BuildingStoreBuilder:
+    """
+    Appends buildings one at a time into typed arrays, without creating a Python object per building.
+
+    Parameters:
+        details (bool): Whether to collect street names and heights.
+    """
+    __slots__ = ('ids', 'lats', 'lons', 'type_codes', 'versions', 'timestamps', 'types', 'type_index', 'addr_streets', 'heights')
+
+    def __init__(self, details=False):
+        self.ids = array.array('q')
+        self.lats = array.array('d')
+        self.lons = array.array('d')
+        self.type_codes = array.array('i')
+        self.versions = array.array('i')
+        self.timestamps = array.array('q')
+        self.types = []
+        self.type_index = {}
+        self.addr_streets = [] if details else None
+        self.heights = [] if details else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, building_id, lat, lon, building_type, version=None, timestamp=MISSING, addr_street='N/A', height='N/A'):
+        """
+        Adds a building.
+
+        Parameters:
+            building_id (int): OSM way ID.
+            lat (float): Center latitude, or NaN if not known yet.
+            lon (float): Center longitude, or NaN if not known yet.
+            building_type (str): Value of the building tag.
+            version (int): Way version, or None.
+            timestamp (int): Edit time in seconds since the epoch, or MISSING.
+            addr_street (str): Street name; only kept if the builder collects details.
+            height (str): Height; only kept if the builder collects details.
+        """
+        code = self.type_index.get(building_type)
+        if code is None:
+            code = self.type_index[building_type] = len(self.types)
+            self.types.append(building_type)
+        self.ids.append(building_id)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.type_codes.append(code)
+        self.versions.append(version if version is not None else MISSING)
+        self.timestamps.append(timestamp)
+        if self.addr_streets is not None:
+            # Street names repeat across many buildings, so share one string per name
+            self.addr_streets.append(sys.intern(addr_street))
+            self.heights.append(sys.intern(height))
+
+    def build(self):
+        return BuildingStore(np.array(self.ids, dtype=np.int64), np.array(self.lats, dtype=np.float64),
+                             np.array(self.lons, dtype=np.float64), np.array(self.type_codes, dtype=np.int32),
+                             np.array(self.versions, dtype=np.int32), np.array(self.timestamps, dtype=np.int64),
+                             self.types, self.addr_streets, self.heights)
@@ -0,0 +1,84 @@
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, Polygon, shape
+
+def boundary_from_geojson(geojson):
+    """
+    Builds a city boundary from a Nominatim `geojson` geometry.
+
+    Parameters:
+        geojson (dict): GeoJSON geometry returned by Nominatim with `polygon_geojson=1`.
+
+    Returns:
+        shapely.geometry.base.BaseGeometry: The (multi)polygon, or None if the geometry has no area.
+    """
+    if not geojson or geojson.get('type') not in ("Polygon", "MultiPolygon"):
+        return None
+    geometry = shape(geojson)
+    if not geometry.is_valid:
+        geometry = geometry.buffer(0)
+    return geometry if not geometry.is_empty else None
+
+def polygon_parts(geometry):
+    if isinstance(geometry, Polygon):
+        return [geometry]
+    if isinstance(geometry, MultiPolygon):
+        return list(geometry.geoms)
+    return [part for part in getattr(geometry, 'geoms', []) if isinstance(part, Polygon)]
+
+def exterior_vertex_count(geometry):
+    return sum(len(part.exterior.coords) for part in polygon_parts(geometry))
+
+def simplify_covering(geometry, max_vertices=200, tolerance=0.0005):
+    """
+    Simplifies a boundary until its outer rings fit in `max_vertices`, growing it so it still covers the original.
+
+    Parameters:
+        geometry (shapely.geometry.base.BaseGeometry): The city boundary.
+        max_vertices (int): Maximum number of exterior ring vertices over all parts.
+        tolerance (float): Initial simplification tolerance in degrees; doubled until the limit is met.
+
+    Returns:
+        shapely.geometry.base.BaseGeometry: The simplified boundary without holes.
+    """
+    outline = shapely.union_all([Polygon(part.exterior) for part in polygon_parts(geometry)])
+    simplified = outline
+    while exterior_vertex_count(simplified) > max_vertices:
+        # Buffering by the tolerance first keeps the simplified outline from cutting into the city
+        simplified = outline.buffer(tolerance).simplify(tolerance)
+        tolerance *= 2
+    return simplified
+
+def overpass_poly_filters(geometry, max_vertices=200):
+    """
+    Converts a boundary into Overpass `poly:` filter strings, one per polygon part.
+
+    Parameters:
+        geometry (shapely.geometry.base.BaseGeometry): The city boundary.
+        max_vertices (int): Maximum number of vertices over all filters.
+
+    Returns:
+        list: Strings of space-separated "lat lon" pairs.
+    """
+    filters = []
+    for part in polygon_parts(simplify_covering(geometry, max_vertices)):
+        coords = list(part.exterior.coords)[:-1]
+        filters.append(" ".join(f"{lat:.6f} {lon:.6f}" for lon, lat in coords))
+    return filters
+
+def points_in_polygon(lats, lons, geometry):
+    """
+    Tests many points at once against a prepared boundary.
+
+    Parameters:
+        lats (numpy.ndarray): Latitudes of the points.
+        lons (numpy.ndarray): Longitudes of the points.
+        geometry (shapely.geometry.base.BaseGeometry): The city boundary.
+
+    Returns:
+        numpy.ndarray: Boolean mask of the points inside or on the boundary.
+    """
+    if len(lats) == 0:
+        return np.zeros(0, dtype=bool)
+    shapely.prepare(geometry)
+    return shapely.intersects_xy(geometry, lons, lats)
@@ -7,7 +7,7 @@ from shapely.geometry import Point
 
 def read_jsonl(file_path):
     """
-    Reads a JSONL file and returns a list of data.
+    Reads a JSONL file and returns a list of data, skipping buildings marked as deleted.
 
     Parameters:
         file_path (str): Path to the JSONL file.
@@ -18,7 +18,9 @@ def read_jsonl(file_path):
     data = []
     with open(file_path, 'r') as file:
         for line in file:
-            data.append(json.loads(line))
+            record = json.loads(line)
+            if not record.get('deleted'):
+                data.append(record)
     return data
 
 def export_to_formats(df, base_export_path, base_filename):
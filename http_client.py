@@ -0,0 +1,289 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)
+
+# Upper bounds on concurrent requests per host; the limiter adapts below these
+DEFAULT_HOST_LIMITS = {
+    "nominatim.openstreetmap.org": 1,
+    "overpass-api.de": 4,
+    "maps.googleapis.com": 32,
+    "api.openai.com": 16,
+}
+DEFAULT_MAX_LIMIT = 16
+
+# Minimum seconds between the starts of two requests to a host, for APIs whose usage policy caps the request rate
+DEFAULT_HOST_INTERVALS = {
+    "nominatim.openstreetmap.org": 1.0,
+}
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one host.
+
+    The limit grows by roughly one slot per round trip while requests succeed at normal latency, and is cut
+    multiplicatively when the host answers 429/503, times out, or its recent latency rises well above its
+    long-run latency. Comparing two moving averages rather than the best latency ever seen keeps ordinary
+    latency spread from reading as congestion. A `Retry-After` from the host pauses all new requests to it until
+    the given time.
+
+    Parameters:
+        max_limit (int): Largest number of concurrent requests allowed.
+        initial_limit (int): Starting limit; defaults to a quarter of `max_limit`.
+        min_limit (int): Smallest limit the controller may shrink to.
+        latency_tolerance (float): Ratio of short-run to long-run latency that counts as congestion.
+        min_interval (float): Minimum seconds between the starts of two requests.
+    """
+    # Weights of the newest sample in the short-run and long-run latency averages
+    SHORT_WEIGHT = 0.2
+    LONG_WEIGHT = 0.02
+    # Latencies below this many seconds are never treated as congestion
+    LATENCY_FLOOR = 0.05
+
+    def __init__(self, max_limit, initial_limit=None, min_limit=1, latency_tolerance=2.0, min_interval=0.0):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.limit = float(initial_limit or max(min_limit, max_limit // 4))
+        self.latency_tolerance = latency_tolerance
+        self.min_interval = min_interval
+        self.in_flight = 0
+        self.short_latency = None
+        self.long_latency = None
+        self.paused_until = 0.0
+        self.next_start = 0.0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                wait = max(self.paused_until, self.next_start) - now
+                if wait > 0:
+                    self.condition.wait(wait)
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    self.condition.wait()
+            self.in_flight += 1
+            self.next_start = now + self.min_interval
+
+    def release(self, latency=None, throttled=False, failed=False):
+        """
+        Frees a slot and adjusts the limit from the outcome of the request.
+
+        Parameters:
+            latency (float): Seconds the request took, or None if it did not complete.
+            throttled (bool): Whether the host signalled overload (429/503).
+            failed (bool): Whether the request timed out or hit a connection error.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled or failed:
+                self.decrease(now, 0.5)
+            elif latency is not None:
+                if self.short_latency is None:
+                    self.short_latency = self.long_latency = latency
+                self.short_latency += self.SHORT_WEIGHT * (latency - self.short_latency)
+                self.long_latency += self.LONG_WEIGHT * (latency - self.long_latency)
+                if (self.short_latency > self.latency_tolerance * self.long_latency
+                        and self.short_latency > self.LATENCY_FLOOR):
+                    self.decrease(now, 0.9)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+            self.condition.notify_all()
+
+    def decrease(self, now, factor):
+        # Only back off once per smoothed round trip so a burst of 429s does not collapse the limit to the floor
+        window = self.short_latency or 0.1
+        if now - self.last_decrease >= window:
+            self.limit = max(self.min_limit, self.limit * factor)
+            self.last_decrease = now
+
+    def pause(self, seconds):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class Host:
+    """Pooled session and adaptive limiter shared by every request to one host."""
+    def __init__(self, name, max_limit, min_interval=0.0):
+        self.name = name
+        self.limiter = AdaptiveLimiter(max_limit, min_interval=min_interval)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_limit)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+def parse_host_limits(value):
+    """
+    Parses host limits of the form "host=limit,host=limit".
+
+    Parameters:
+        value (str): The limits string, e.g. from BUILDINGVIEW_HOST_LIMITS.
+
+    Returns:
+        dict: Maps host names to their maximum concurrency.
+    """
+    limits = {}
+    for item in (value or "").split(','):
+        if '=' in item:
+            host, limit = item.split('=', 1)
+            limits[host.strip()] = int(limit)
+    return limits
+
+HOST_LIMITS = dict(DEFAULT_HOST_LIMITS, **parse_host_limits(os.environ.get("BUILDINGVIEW_HOST_LIMITS")))
+
+def get_host(url):
+    """
+    Returns the shared host state for a URL, creating it on first use.
+
+    Parameters:
+        url (str): Any URL on the host.
+
+    Returns:
+        Host: The host's session and limiter.
+    """
+    name = urlparse(url).netloc
+    with _hosts_lock:
+        host = _hosts.get(name)
+        if host is None:
+            hostname = name.split(':')[0]
+            host = Host(name, HOST_LIMITS.get(name, HOST_LIMITS.get(hostname, DEFAULT_MAX_LIMIT)),
+                        DEFAULT_HOST_INTERVALS.get(name, DEFAULT_HOST_INTERVALS.get(hostname, 0.0)))
+            _hosts[name] = host
+        return host
+
+def set_host_limit(host_name, max_limit):
+    """
+    Overrides the maximum concurrency for a host before its first request.
+
+    Parameters:
+        host_name (str): Host name, optionally with port.
+        max_limit (int): Maximum number of concurrent requests.
+    """
+    HOST_LIMITS[host_name] = max_limit
+    with _hosts_lock:
+        _hosts.pop(host_name, None)
+
+def max_workers(url):
+    """
+    Returns a worker pool size that lets requests to the URL's host reach the host's concurrency limit.
+
+    Parameters:
+        url (str): Any URL on the host.
+
+    Returns:
+        int: The host's maximum concurrency.
+    """
+    return get_host(url).limiter.max_limit
+
+def retry_after_seconds(response):
+    """
+    Reads a `Retry-After` header given either in seconds or as an HTTP date.
+
+    Parameters:
+        response (requests.Response): The response to inspect.
+
+    Returns:
+        float: Seconds to wait, or None if the header is missing or invalid.
+    """
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base=0.5, cap=60.0):
+    """
+    Full-jitter exponential backoff.
+
+    Parameters:
+        attempt (int): Number of the retry, starting at 1.
+        base (float): Delay scale in seconds.
+        cap (float): Upper bound on the delay.
+
+    Returns:
+        float: Seconds to wait before the retry.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def request(method, url, stage="http", max_retries=5, timeout=(10, 120), **kwargs):
+    """
+    Sends a request through the host's pooled session and adaptive limiter, retrying transient failures.
+
+    429, 5xx responses, timeouts and connection errors are retried with jittered exponential backoff that
+    honours `Retry-After`. Other responses are returned as is, so callers keep using `raise_for_status`.
+
+    Parameters:
+        method (str): HTTP method.
+        url (str): Request URL.
+        stage (str): Pipeline stage used to label metrics.
+        max_retries (int): Number of retries after the first attempt.
+        timeout (tuple): Connect and read timeouts in seconds.
+        **kwargs: Passed on to `requests.Session.request`.
+
+    Returns:
+        requests.Response: The final response; may still have an error status once retries are exhausted.
+
+    Raises:
+        requests.exceptions.RequestException: If the last attempt failed without a response.
+    """
+    host = get_host(url)
+    limiter = host.limiter
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        metrics.set_gauge("buildingview_concurrency_limit", int(limiter.limit), host=host.name)
+        start = time.perf_counter()
+        try:
+            with metrics.request_span(stage, attempt=attempt, host=host.name) as span:
+                span.response = response = host.session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            limiter.release(failed=True)
+            if attempt == max_retries:
+                raise
+            metrics.record_retry(stage)
+            time.sleep(backoff_delay(attempt + 1))
+            continue
+        except Exception:
+            limiter.release()
+            raise
+
+        throttled = response.status_code in THROTTLE_STATUSES
+        limiter.release(latency=time.perf_counter() - start, throttled=throttled)
+        if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+            return response
+
+        delay = backoff_delay(attempt + 1)
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+            limiter.pause(retry_after)
+        metrics.record_retry(stage)
+        response.close()
+        time.sleep(delay)
+
+def get(url, stage="http", **kwargs):
+    return request("GET", url, stage=stage, **kwargs)
+
+def post(url, stage="http", **kwargs):
+    return request("POST", url, stage=stage, **kwargs)
@@ -32,13 +32,17 @@ def read_failed_images(failed_log_file):
 def merge_jsonl_files(file1, file2, output_file):
     print("Merging JSONL files...")
     data = {}
+    # Buildings removed from OSM are kept as tombstones by incremental_refresh.py and left out of the results
+    deleted = set()
     def load_jsonl(file):
         with open(file, 'r', encoding='utf-8') as f:
             for line in f:
                 try:
                     record = json.loads(line)
                     record_id = str(record['id']).strip('"')
-                    if record_id not in data:
+                    if record.get('deleted'):
+                        deleted.add(record_id)
+                    elif record_id not in data:
                         data[record_id] = record
                     else:
                         data[record_id].update(record)
@@ -47,7 +51,9 @@ def merge_jsonl_files(file1, file2, output_file):
     load_jsonl(file1)
     load_jsonl(file2)
     with open(output_file, 'w', encoding='utf-8') as f:
-        for record in data.values():
+        for record_id, record in data.items():
+            if record_id in deleted:
+                continue
             json.dump(record, f)
             f.write('\n')
     print(f"Successfully merged files into {output_file}")
@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import random
+import time
+import numpy as np
+import metrics
+from city_boundary import points_in_polygon
+from Overpass import (BUILDING_TYPES, building_record, dataset_filename, fetch_all_details, fetch_city_boundary,
+                      fetch_building_centers, index_filename, save_index)
+
+def read_jsonl(file_path):
+    """
+    Reads a JSONL file and returns a list of records.
+
+    Parameters:
+        file_path (str): Path to the JSONL file.
+
+    Returns:
+        list: List of records, empty if the file does not exist.
+    """
+    records = []
+    if os.path.exists(file_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+def write_jsonl(records, file_path):
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            json.dump(record, f, ensure_ascii=False)
+            f.write('\n')
+
+def load_index(dataset_file):
+    """
+    Loads the harvest index of a dataset, falling back to the dataset's modification time when there is none.
+
+    Parameters:
+        dataset_file (str): Path to the dataset JSONL file.
+
+    Returns:
+        tuple: Harvest time as an ISO 8601 string and a dict mapping building IDs to versions (None without an index).
+    """
+    index_file = index_filename(dataset_file)
+    if os.path.exists(index_file):
+        with open(index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        return index['harvested_at'], index['buildings']
+    harvested_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(os.path.getmtime(dataset_file)))
+    return harvested_at, None
+
+def diff_buildings(records, current, harvested_at, index=None, polygon=None):
+    """
+    Compares a stored dataset with a fresh Overpass result by way ID and version.
+
+    Buildings are new if the previous harvest's index does not list them. Without an index, buildings edited after
+    the previous harvest that are not in the dataset count as new. Datasets harvested before buildings were filtered
+    by the city polygon cover the whole bounding box; stored buildings outside `polygon` are left as they are
+    instead of being marked as removed. `current` must be a complete result: buildings missing from a cut-off
+    Overpass response would be marked as removed.
+
+    Parameters:
+        records (list): Stored dataset records.
+        current (BuildingStore): Buildings from `fetch_building_centers`.
+        harvested_at (str): Time of the previous harvest as an ISO 8601 string.
+        index (dict): Building IDs and versions of the previous harvest, or None.
+        polygon (shapely.geometry.base.BaseGeometry): The city boundary `current` was filtered by, or None.
+
+    Returns:
+        tuple: Lists of added buildings, changed buildings and removed records.
+    """
+    current_by_id = {str(building['id']): building for building in current.take(current.type_mask(BUILDING_TYPES))}
+    stored_ids = set()
+    changed = []
+    removed = []
+    for record in records:
+        record_id = str(record['id'])
+        stored_ids.add(record_id)
+        building = current_by_id.get(record_id)
+        if building is None:
+            if not record.get('deleted'):
+                removed.append(record)
+        elif record.get('deleted'):
+            changed.append(building)
+        elif record.get('version') is not None:
+            if building['version'] != record['version']:
+                changed.append(building)
+        elif (building.get('timestamp') or '') > harvested_at:
+            changed.append(building)
+
+    if polygon is not None and removed:
+        inside = points_in_polygon(np.array([record['lat'] for record in removed], dtype=np.float64),
+                                   np.array([record['lon'] for record in removed], dtype=np.float64), polygon)
+        outside = len(removed) - int(inside.sum())
+        if outside:
+            print(f"Keeping {outside} buildings outside the city boundary from an earlier bounding box harvest")
+        removed = [record for record, keep in zip(removed, inside.tolist()) if keep]
+
+    added = []
+    for building_id, building in current_by_id.items():
+        if building_id in stored_ids:
+            continue
+        if index is not None:
+            if building_id not in index:
+                added.append(building)
+        elif (building.get('timestamp') or '') > harvested_at:
+            added.append(building)
+    return added, changed, removed
+
+def refresh_dataset(city_name, country_name, max_elements):
+    """
+    Refreshes a harvested dataset in place, fetching details only for added and changed buildings.
+
+    New buildings are sampled at the rate of the original harvest so the dataset stays a representative sample.
+    Removed buildings are kept as tombstones with 'deleted' set. The added and changed records are also written to
+    a delta file that drives the image download and annotation.
+
+    Parameters:
+        city_name (str): Name of the city.
+        country_name (str): Name of the country.
+        max_elements (int): Maximum number of building elements of the original harvest.
+
+    Returns:
+        dict: Paths of the dataset and delta files and the IDs of the added, changed and removed buildings, or None on failure.
+    """
+    dataset_file = dataset_filename(city_name, country_name, max_elements)
+    if not os.path.exists(dataset_file):
+        print(f"No dataset to refresh at {dataset_file}; run Overpass.py first")
+        return None
+    records = read_jsonl(dataset_file)
+    harvested_at, index = load_index(dataset_file)
+
+    boundary = fetch_city_boundary(city_name, country_name)
+    if boundary is None:
+        print(f"Failed to fetch bounding box for city: {city_name} in country: {country_name}")
+        return None
+    bbox, polygon = boundary
+    current = fetch_building_centers(*bbox, polygon=polygon)
+    if current is None:
+        return None
+
+    added, changed, removed = diff_buildings(records, current, harvested_at, index, polygon)
+
+    # Keep the sampling rate of the previous harvest for new buildings
+    previous_total = len(index) if index is not None else len(current) - len(added)
+    sample_rate = min(1.0, max_elements / previous_total) if previous_total > 0 else 1.0
+    added = random.sample(added, round(len(added) * sample_rate))
+    print(f"Refresh of {dataset_file}: {len(added)} added, {len(changed)} changed, {len(removed)} removed")
+
+    fetched = {str(building['id']): building_record(building) for building in fetch_all_details(added + changed)}
+
+    deleted_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    removed_ids = {str(record['id']) for record in removed}
+    refreshed = []
+    for record in records:
+        record_id = str(record['id'])
+        if record_id in fetched:
+            refreshed.append(fetched.pop(record_id))
+        elif record_id in removed_ids:
+            refreshed.append(dict(record, deleted=True, deleted_at=deleted_at))
+        else:
+            refreshed.append(record)
+    refreshed.extend(fetched[str(building['id'])] for building in added)
+
+    delta_ids = {str(building['id']) for building in added + changed}
+    delta = [record for record in refreshed if str(record['id']) in delta_ids]
+    delta_file = os.path.splitext(dataset_file)[0] + "_delta.jsonl"
+    write_jsonl(refreshed, dataset_file)
+    write_jsonl(delta, delta_file)
+    save_index(current, index_filename(dataset_file))
+    print(f"Data saved to {dataset_file}, delta saved to {delta_file}")
+
+    return {
+        'dataset_file': dataset_file,
+        'delta_file': delta_file,
+        'added': [str(building['id']) for building in added],
+        'changed': [str(building['id']) for building in changed],
+        'removed': sorted(removed_ids)
+    }
+
+def drop_labels(label_file, building_ids):
+    """
+    Removes the annotations of the given buildings so that they are annotated again.
+
+    Parameters:
+        label_file (str): Path to the label JSONL file written by `openai.py`.
+        building_ids (set): IDs of the buildings whose labels are dropped.
+    """
+    if not building_ids or not os.path.exists(label_file):
+        return
+    labels = [record for record in read_jsonl(label_file) if str(record['id']).strip('"') not in building_ids]
+    write_jsonl(labels, label_file)
+
+if __name__ == "__main__":
+    metrics.configure_from_env()
+    parser = argparse.ArgumentParser(description='Incrementally refresh a harvested building dataset.')
+    parser.add_argument('city_name', type=str, help='Name of the city.')
+    parser.add_argument('country_name', type=str, help='Name of the country.')
+    parser.add_argument('max_elements', type=int, help='Maximum number of building elements of the original harvest.')
+    parser.add_argument('--api_key', type=str, help='Google Maps API key to download images of added and changed buildings.')
+    parser.add_argument('--prompt_file', type=str, help='Prompt file to annotate the downloaded images.')
+    parser.add_argument('--api_keys_file', type=str, help='File containing the OpenAI API keys.')
+
+    args = parser.parse_args()
+    result = refresh_dataset(args.city_name, args.country_name, args.max_elements)
+    if result:
+        name = os.path.splitext(os.path.basename(result['dataset_file']))[0]
+        image_folder = os.path.join("GoogleStreetViewImages", name)
+        drop_labels(os.path.join("Data", f"{name}_label.jsonl"), set(result['changed']))
+
+        if args.api_key:
+            from StreetView_donloader import download_street_views
+            download_street_views(result['delta_file'], args.api_key, image_folder)
+
+            if args.prompt_file and args.api_keys_file:
+                # Only images without a label are annotated, i.e. the added and changed buildings
+                from image_processing_pipeline import main as annotate
+                annotate(image_folder, args.prompt_file, args.api_keys_file)
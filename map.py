@@ -5,7 +5,7 @@ import folium
 
 def read_jsonl(file_path):
     """
-    Reads a JSONL file and returns a list of building data.
+    Reads a JSONL file and returns a list of building data, skipping buildings marked as deleted.
 
     Parameters:
         file_path (str): Path to the JSONL file.
@@ -17,7 +17,8 @@ def read_jsonl(file_path):
     with open(file_path, 'r') as f:
         for line in f:
             building = json.loads(line)
-            buildings.append(building)
+            if not building.get('deleted'):
+                buildings.append(building)
     return buildings
 
 if __name__ == "__main__":
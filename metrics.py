@@ -0,0 +1,294 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    "buildingview_requests_total": ("counter", "Outbound HTTP requests by stage and status."),
+    "buildingview_response_bytes_total": ("counter", "Response bytes received by stage."),
+    "buildingview_retries_total": ("counter", "Retried requests by stage."),
+    "buildingview_rate_limited_total": ("counter", "Requests answered with 429 by stage."),
+    "buildingview_request_latency_seconds": ("histogram", "Outbound HTTP request latency by stage."),
+    "buildingview_queue_depth": ("gauge", "Work items waiting in a stage."),
+    "buildingview_items_total": ("counter", "Work items finished by stage and outcome."),
+    "buildingview_api_key_requests": ("gauge", "Requests sent with each API key."),
+    "buildingview_concurrency_limit": ("gauge", "Current adaptive concurrency limit by host."),
+    "buildingview_overpass_endpoint_up": ("gauge", "Whether an Overpass endpoint is in rotation."),
+}
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Registry:
+    """
+    Thread-safe store of counters, gauges and histograms keyed by metric name and labels.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.trace_file = None
+        self.run_id = uuid.uuid4().hex[:16]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+                self.histograms[key] = histogram
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def trace(self, record):
+        if self.trace_file is None:
+            return
+        line = json.dumps(dict(record, run_id=self.run_id)) + '\n'
+        with self.lock:
+            self.trace_file.write(line)
+
+    def snapshot(self):
+        """
+        Returns a JSON-serializable copy of all metrics.
+
+        Returns:
+            dict: Counters, gauges and histograms as lists of {name, labels, value} records.
+        """
+        with self.lock:
+            return {
+                'run_id': self.run_id,
+                'timestamp': time.time(),
+                'counters': [{'name': n, 'labels': dict(l), 'value': v} for (n, l), v in sorted(self.counters.items())],
+                'gauges': [{'name': n, 'labels': dict(l), 'value': v} for (n, l), v in sorted(self.gauges.items())],
+                'histograms': [
+                    {'name': n, 'labels': dict(l), 'buckets': list(h['buckets']), 'counts': list(h['counts']),
+                     'sum': h['sum'], 'count': h['count']}
+                    for (n, l), h in sorted(self.histograms.items())
+                ]
+            }
+
+    def to_prometheus(self):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition text.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        described = set()
+
+        def describe(name, default_type):
+            if name in described:
+                return
+            described.add(name)
+            metric_type, help_text = METRIC_HELP.get(name, (default_type, name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        def label_text(labels, extra=None):
+            items = list(labels.items()) + (extra or [])
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in items) + "}"
+
+        for kind, default_type in (('counters', 'counter'), ('gauges', 'gauge')):
+            for record in snapshot[kind]:
+                describe(record['name'], default_type)
+                lines.append(f"{record['name']}{label_text(record['labels'])} {record['value']}")
+        for record in snapshot['histograms']:
+            name = record['name']
+            describe(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(record['buckets'], record['counts']):
+                cumulative += count
+                lines.append(f"{name}_bucket{label_text(record['labels'], [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{label_text(record['labels'], [('le', '+Inf')])} {record['count']}")
+            lines.append(f"{name}_sum{label_text(record['labels'])} {record['sum']}")
+            lines.append(f"{name}_count{label_text(record['labels'])} {record['count']}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def inc(name, value=1, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+def set_gauge(name, value, **labels):
+    REGISTRY.set_gauge(name, value, **labels)
+
+def observe(name, value, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+class RequestSpan:
+    """
+    Collects the outcome of one outbound request inside `request_span`.
+
+    Attributes:
+        response (requests.Response): Set by the caller once the request returns.
+        attrs (dict): Extra attributes written to the trace record.
+    """
+    def __init__(self, attrs):
+        self.response = None
+        self.attrs = attrs
+
+@contextmanager
+def request_span(stage, **attrs):
+    """
+    Measures one outbound request and records its status, bytes, latency and 429s for a stage.
+
+    Usage:
+        with metrics.request_span("streetview", location_id=1) as span:
+            span.response = requests.get(url)
+
+    Parameters:
+        stage (str): Pipeline stage the request belongs to.
+        **attrs: Extra attributes for the trace record.
+    """
+    span = RequestSpan(attrs)
+    started = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield span
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        response = span.response
+        status = str(response.status_code) if response is not None else (error or "none")
+        inc("buildingview_requests_total", stage=stage, status=status)
+        observe("buildingview_request_latency_seconds", elapsed, stage=stage)
+        if response is not None:
+            size = response.headers.get('Content-Length')
+            if size is None and getattr(response, '_content_consumed', False):
+                size = len(response.content or b"")
+            if size is not None:
+                inc("buildingview_response_bytes_total", int(size), stage=stage)
+            if response.status_code == 429:
+                inc("buildingview_rate_limited_total", stage=stage)
+        REGISTRY.trace({
+            'span_id': uuid.uuid4().hex[:16],
+            'stage': stage,
+            'start': started,
+            'duration_ms': elapsed * 1000,
+            'status': status,
+            'attrs': span.attrs
+        })
+
+def record_retry(stage):
+    inc("buildingview_retries_total", stage=stage)
+
+def record_item(stage, outcome):
+    inc("buildingview_items_total", stage=stage, outcome=outcome)
+
+def record_queue_depth(stage, depth):
+    set_gauge("buildingview_queue_depth", depth, stage=stage)
+
+def record_key_usage(request_counters):
+    """
+    Publishes per-key usage from an API key request counter dictionary.
+
+    Parameters:
+        request_counters (dict): Maps API key index to the number of requests sent with it.
+    """
+    for key_index, count in list(request_counters.items()):
+        set_gauge("buildingview_api_key_requests", count, key=str(key_index))
+
+def write_json(path):
+    """
+    Writes a snapshot of all metrics to a JSON file.
+
+    Parameters:
+        path (str): Destination file; `{pid}` is replaced with the process ID.
+    """
+    path = path.format(pid=os.getpid())
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(REGISTRY.snapshot(), f, indent=2)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.to_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_http_server(port, host="127.0.0.1"):
+    """
+    Serves the metrics in Prometheus text format on /metrics from a background thread.
+
+    Parameters:
+        port (int): Port to listen on.
+        host (str): Interface to bind; only the local machine can connect by default, since the metrics include
+            per-key usage. Use "0.0.0.0" to serve on all interfaces.
+
+    Returns:
+        ThreadingHTTPServer: The running server.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def configure_from_env():
+    """
+    Enables the exporters selected through environment variables.
+
+    BUILDINGVIEW_METRICS_PORT serves Prometheus text on that port of the interface in BUILDINGVIEW_METRICS_HOST
+    (127.0.0.1 by default), BUILDINGVIEW_METRICS_FILE writes a JSON
+    snapshot when the process exits and BUILDINGVIEW_TRACE_FILE appends one JSON line per request span.
+    File paths may contain `{pid}` so that concurrent processes do not overwrite each other.
+    """
+    port = os.environ.get("BUILDINGVIEW_METRICS_PORT")
+    if port:
+        host = os.environ.get("BUILDINGVIEW_METRICS_HOST", "127.0.0.1")
+        try:
+            start_http_server(int(port), host)
+            print(f"Serving metrics on {host}:{port}")
+        except OSError as e:
+            print(f"Could not start metrics server on port {port}: {e}")
+
+    metrics_file = os.environ.get("BUILDINGVIEW_METRICS_FILE")
+    if metrics_file:
+        atexit.register(write_json, metrics_file)
+
+    trace_file = os.environ.get("BUILDINGVIEW_TRACE_FILE")
+    if trace_file:
+        trace_file = trace_file.format(pid=os.getpid())
+        directory = os.path.dirname(trace_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        REGISTRY.trace_file = open(trace_file, 'a', encoding='utf-8', buffering=1)
+        atexit.register(REGISTRY.trace_file.close)
@@ -3,9 +3,16 @@ import base64
 import requests
 import os
 import json
-import time
+import threading
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
+import http_client
+import metrics
+
+OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+
+# Guards the API key request counters, which are shared by all worker threads
+request_counters_lock = threading.Lock()
 
 def load_prompt(prompt_file):
     with open(prompt_file, 'r', encoding='utf-8') as file:
@@ -47,47 +54,36 @@ def process_image(api_key, base64_image, prompt):
         "max_tokens": 300
     }
 
-    for attempt in range(1, 6):  # Retry up to 5 times
-        try:
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-            response.raise_for_status()
-            response_data = response.json()
-            if 'choices' in response_data and response_data['choices']:
-                content = response_data['choices'][0]['message']['content']
-                return content
-            else:
-                raise ValueError("Response does not contain 'choices'")
-        except requests.exceptions.RequestException as e:
-            if response.status_code == 429:
-                print(f"Rate limit exceeded, retrying in {2 ** attempt} seconds...")
-                time.sleep(2 ** attempt)
-            else:
-                print(f"Error processing image: {e}")
-                break
-        except (ValueError, KeyError) as e:
-            print(f"Error processing image: {e}")
-            break
+    # The shared HTTP client retries 429s, 5xx responses and timeouts with backoff that honours Retry-After
+    try:
+        response = http_client.post(OPENAI_URL, stage="openai", headers=headers, json=payload)
+        response.raise_for_status()
+        response_data = response.json()
+        if 'choices' in response_data and response_data['choices']:
+            content = response_data['choices'][0]['message']['content']
+            return content
+        else:
+            raise ValueError("Response does not contain 'choices'")
+    except requests.exceptions.RequestException as e:
+        print(f"Error processing image: {e}")
+    except (ValueError, KeyError) as e:
+        print(f"Error processing image: {e}")
     return None
 
 def process_single_image(image_path, api_keys, request_counters, prompt):
     base64_image = encode_image(image_path)
 
-    # Find the API key with the least requests or next in round-robin fashion
-    key_index = min(request_counters, key=request_counters.get)
+    # Find the API key with the least requests and count the request against it before sending,
+    # so that concurrent workers spread over the keys
+    with request_counters_lock:
+        key_index = min(request_counters, key=request_counters.get)
+        request_counters[key_index] += 1
+        metrics.record_key_usage(request_counters)
     api_key = api_keys[key_index]
 
     # Process the image
     result = process_image(api_key, base64_image, prompt)
 
-    # Increment the request counter
-    request_counters[key_index] += 1
-
-    # If an API key reaches 30 requests, pause and reset its counter
-    if request_counters[key_index] >= 30:
-        print(f"Pausing for API key {key_index} after 30 requests...")
-        time.sleep(2)  # Adjust the sleep time as needed
-        request_counters[key_index] = 0  # Reset the counter
-
     return result, key_index
 
 def normalize_id(id_value):
@@ -130,11 +126,13 @@ def process_directory(directory_path, prompt_file, api_keys_file, failed_log_fil
         return
 
     with open(output_file, 'a') as file, open(failed_log_file, 'w') as failed_file, ThreadPoolExecutor(
-            max_workers=3) as executor:  # Adjust max_workers as needed
+            max_workers=http_client.max_workers(OPENAI_URL)) as executor:
         futures = {executor.submit(process_single_image, image_path, api_keys, request_counters, prompt): image_path for
                    image_path in images_to_process}
+        metrics.record_queue_depth("openai", len(futures))
 
-        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing Images"):
+        for completed, future in enumerate(tqdm(as_completed(futures), total=len(futures), desc="Processing Images"), 1):
+            metrics.record_queue_depth("openai", len(futures) - completed)
             image_path = futures[future]
             image_id = normalize_id(os.path.basename(image_path).split('.jpg')[0])
             try:
@@ -142,14 +140,18 @@ def process_directory(directory_path, prompt_file, api_keys_file, failed_log_fil
                 if result:
                     json_record = json.dumps({"id": image_id, "content": result})
                     file.write(json_record + "\n")
+                    metrics.record_item("openai", "ok")
                 else:
                     print(f"Failed to process image {image_id} with API key {key_index}")
                     failed_file.write(image_path + "\n")
+                    metrics.record_item("openai", "failed")
             except Exception as e:
                 print(f"Error processing image {image_id}: {e}")
                 failed_file.write(image_path + "\n")
+                metrics.record_item("openai", "failed")
 
 if __name__ == "__main__":
+    metrics.configure_from_env()
     parser = argparse.ArgumentParser(description='Process images using OpenAI API.')
     parser.add_argument('--directory', type=str, required=True, help='Directory containing images to process.')
     parser.add_argument('--prompt_file', type=str, required=True, help='File containing the prompt.')
@@ -0,0 +1,136 @@
+import argparse
+import math
+import osmium
+from tqdm import tqdm
+from building_store import MISSING, BuildingStoreBuilder
+from Overpass import categorize_store, dataset_filename, fetch_city_boundary, index_filename, save_index, save_to_jsonl
+
+def way_center(way):
+    """
+    Computes the center of a way's bounding box, as Overpass `out center` does.
+
+    Parameters:
+        way (osmium.osm.Way): A way with node locations.
+
+    Returns:
+        tuple: The (lat, lon) of the center, or None if none of its nodes are in the extract.
+    """
+    south = west = math.inf
+    north = east = -math.inf
+    for node in way.nodes:
+        location = node.location
+        # Nodes missing from the extract, e.g. at its border, are skipped
+        if not location.valid():
+            continue
+        lat = location.lat
+        lon = location.lon
+        south = min(south, lat)
+        north = max(north, lat)
+        west = min(west, lon)
+        east = max(east, lon)
+    if south == math.inf:
+        return None
+    return (south + north) / 2, (west + east) / 2
+
+def read_buildings(pbf_path, bbox=None, max_elements=None, polygon=None, index_type="flex_mem", index_file=None):
+    """
+    Streams the building ways of a PBF extract with their center coordinates.
+
+    The extract is read in a single pass with pyosmium, which keeps node locations in a compact C++ index and
+    decompresses blocks in background threads. Buildings outside the bounding box, or outside the polygon's bounds,
+    are dropped as they are read, so only the buildings of the area are kept in memory.
+
+    Parameters:
+        pbf_path (str): Path to the .osm.pbf file.
+        bbox (tuple): Optional (south, west, north, east) to keep only buildings whose center lies inside.
+        max_elements (int): Optional number of buildings to randomly sample.
+        polygon (shapely.geometry.base.BaseGeometry): Optional boundary to keep only buildings whose center lies inside.
+        index_type (str): pyosmium node location index; use e.g. "dense_file_array,nodes.cache" to keep the
+            index on disk for country or planet extracts.
+        index_file (str): Optional file to save the IDs and versions of all buildings found, for incremental refreshes.
+
+    Returns:
+        BuildingStore: The buildings with their IDs, centers, types, addresses, heights, versions and timestamps.
+    """
+    if bbox is None and polygon is not None:
+        west, south, east, north = polygon.bounds
+        bbox = (south, west, north, east)
+
+    processor = (osmium.FileProcessor(pbf_path, osmium.osm.NODE | osmium.osm.WAY)
+                 .with_locations(index_type)
+                 .with_filter(osmium.filter.EntityFilter(osmium.osm.WAY))
+                 .with_filter(osmium.filter.KeyFilter("building")))
+    builder = BuildingStoreBuilder(details=True)
+    found = 0
+    for way in tqdm(processor, desc="Scanning building ways", unit=" buildings"):
+        found += 1
+        center = way_center(way)
+        if center is None:
+            continue
+        lat, lon = center
+        if bbox is not None and not (bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]):
+            continue
+        tags = way.tags
+        # Extracts without metadata have version 0 and the epoch as timestamp
+        version = way.version or None
+        timestamp = int(way.timestamp.timestamp()) if version is not None else MISSING
+        builder.append(way.id, lat, lon, tags.get("building"), version, timestamp,
+                       tags.get("addr:street", "N/A"), tags.get("height", "N/A"))
+    print(f"Found {found} buildings")
+
+    buildings = builder.build()
+    if polygon is not None:
+        buildings = buildings.within(polygon)
+    if index_file:
+        save_index(buildings, index_file)
+    if max_elements is not None:
+        buildings = buildings.sample(max_elements)
+    return buildings
+
+def fetch_building_data_from_pbf(pbf_path, max_elements=100, bbox=None, polygon=None, index_type="flex_mem",
+                                 index_file=None):
+    """
+    Fetches a random sample of buildings from a local PBF extract, categorized by building types.
+
+    Gives the same records as `Overpass.fetch_building_data`, with address and height read from the extract
+    instead of per-building Overpass queries.
+
+    Parameters:
+        pbf_path (str): Path to the .osm.pbf file.
+        max_elements (int): Maximum number of building elements to fetch.
+        bbox (tuple): Optional (south, west, north, east) bounding box.
+        polygon (shapely.geometry.base.BaseGeometry): Optional city boundary.
+        index_type (str): pyosmium node location index.
+        index_file (str): Optional file to save the IDs and versions of all buildings found, for incremental refreshes.
+
+    Returns:
+        dict: Lists of building records with IDs, coordinates, addresses and heights, keyed by building type.
+    """
+    buildings = read_buildings(pbf_path, bbox, max_elements, polygon, index_type, index_file)
+    if not buildings:
+        print("No buildings found")
+        return None
+    print(f"Total buildings extracted: {len(buildings)}")
+    return categorize_store(buildings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fetch building data for a city from a local .osm.pbf extract.')
+    parser.add_argument('pbf_path', type=str, help='Path to the .osm.pbf extract.')
+    parser.add_argument('city_name', type=str, help='Name of the city.')
+    parser.add_argument('country_name', type=str, help='Name of the country.')
+    parser.add_argument('max_elements', type=int, help='Maximum number of building elements.')
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'),
+                        help='Bounding box to use instead of looking up the city boundary with Nominatim.')
+    parser.add_argument('--index', type=str, default='flex_mem',
+                        help='pyosmium node location index, e.g. "dense_file_array,nodes.cache" for large extracts.')
+
+    args = parser.parse_args()
+    boundary = (tuple(args.bbox), None) if args.bbox else fetch_city_boundary(args.city_name, args.country_name)
+    if boundary is None:
+        print(f"Failed to fetch bounding box for city: {args.city_name} in country: {args.country_name}")
+    else:
+        bbox, polygon = boundary
+        index_file = index_filename(dataset_filename(args.city_name, args.country_name, args.max_elements))
+        building_data = fetch_building_data_from_pbf(args.pbf_path, args.max_elements, bbox, polygon, args.index, index_file)
+        if building_data:
+            save_to_jsonl(building_data, args.city_name, args.country_name, args.max_elements)
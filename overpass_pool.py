@@ -0,0 +1,170 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import http_client
+import metrics
+
+class Endpoint:
+    """
+    Health state of one Overpass API interpreter URL.
+
+    Parameters:
+        url (str): The interpreter URL, e.g. "https://overpass-api.de/api/interpreter".
+    """
+    def __init__(self, url):
+        self.url = url
+        self.status_url = url.rsplit('/', 1)[0] + "/status"
+        self.failures = 0
+        self.down_until = 0.0
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def spare_capacity(self):
+        limiter = http_client.get_host(self.url).limiter
+        return limiter.limit - limiter.in_flight
+
+class EndpointPool:
+    """
+    Spreads Overpass queries over several endpoints and fails over when one is down or overloaded.
+
+    Queries go to the healthy endpoint with the most spare capacity in the shared HTTP client. An endpoint that
+    fails is taken out of rotation for a cooldown that doubles with each consecutive failure, after which it is
+    tried again.
+
+    Parameters:
+        urls (list): Interpreter URLs of the Overpass instances.
+        cooldown (float): Seconds an endpoint stays out of rotation after its first failure.
+        max_cooldown (float): Upper bound on the cooldown.
+    """
+    def __init__(self, urls, cooldown=30.0, max_cooldown=600.0):
+        if not urls:
+            raise ValueError("At least one Overpass endpoint is required")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.lock = threading.Lock()
+
+    def check_health(self, timeout=5):
+        """
+        Probes every endpoint's /api/status page in parallel and takes unreachable ones out of rotation.
+
+        Parameters:
+            timeout (float): Seconds to wait for each probe.
+
+        Returns:
+            dict: Maps endpoint URLs to whether they are healthy.
+        """
+        def probe(endpoint):
+            try:
+                response = requests.get(endpoint.status_url, timeout=timeout)
+                # Instances without a status page still answer 404 when they are up
+                return response.status_code < 500
+            except requests.exceptions.RequestException:
+                return False
+
+        with ThreadPoolExecutor(max_workers=len(self.endpoints)) as executor:
+            results = list(executor.map(probe, self.endpoints))
+        for endpoint, ok in zip(self.endpoints, results):
+            if ok:
+                self.mark_success(endpoint)
+            else:
+                self.mark_failure(endpoint)
+        return {endpoint.url: ok for endpoint, ok in zip(self.endpoints, results)}
+
+    def mark_success(self, endpoint):
+        with self.lock:
+            endpoint.failures = 0
+            endpoint.down_until = 0.0
+        metrics.set_gauge("buildingview_overpass_endpoint_up", 1, endpoint=endpoint.url)
+
+    def mark_failure(self, endpoint):
+        with self.lock:
+            endpoint.failures += 1
+            cooldown = min(self.max_cooldown, self.cooldown * 2 ** (endpoint.failures - 1))
+            endpoint.down_until = time.monotonic() + cooldown
+        metrics.set_gauge("buildingview_overpass_endpoint_up", 0, endpoint=endpoint.url)
+        print(f"Overpass endpoint {endpoint.url} unavailable, retrying it in {cooldown:.0f} seconds")
+
+    def candidates(self):
+        """
+        Orders the endpoints for the next query.
+
+        Returns:
+            list: Healthy endpoints by decreasing spare capacity, followed by the others by when they recover.
+        """
+        healthy = [e for e in self.endpoints if e.healthy]
+        random.shuffle(healthy)
+        healthy.sort(key=lambda e: e.spare_capacity(), reverse=True)
+        down = sorted((e for e in self.endpoints if not e.healthy), key=lambda e: e.down_until)
+        return healthy + down
+
+    def max_workers(self):
+        return sum(http_client.max_workers(endpoint.url) for endpoint in self.endpoints)
+
+    def query(self, query, stage="overpass", timeout=(10, 120)):
+        """
+        Runs an Overpass QL query, failing over to the next endpoint on errors, 429s and 5xx responses.
+
+        Parameters:
+            query (str): The Overpass QL query.
+            stage (str): Pipeline stage used to label metrics.
+            timeout (tuple): Connect and read timeouts in seconds for each request.
+
+        Returns:
+            requests.Response: The response of the first endpoint that answered, or the last response received.
+
+        Raises:
+            requests.exceptions.RequestException: If every endpoint failed without a response.
+        """
+        candidates = self.candidates()
+        response = None
+        error = None
+        for index, endpoint in enumerate(candidates):
+            last = index == len(candidates) - 1
+            try:
+                # Move on to the next endpoint at once, without backoff or Retry-After waits, while others remain;
+                # retry fully on the last one. POST keeps long poly: filters out of the URL.
+                response = http_client.post(endpoint.url, stage=stage, data={'data': query},
+                                            max_retries=5 if last else 0, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                error = e
+                self.mark_failure(endpoint)
+                continue
+            if response.status_code in http_client.RETRY_STATUSES:
+                self.mark_failure(endpoint)
+                continue
+            if endpoint.failures:
+                self.mark_success(endpoint)
+            return response
+        if response is not None:
+            return response
+        raise error
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(urls):
+    """
+    Returns the shared pool for a list of endpoints, probing their health on first use.
+
+    Parameters:
+        urls (list): Interpreter URLs of the Overpass instances.
+
+    Returns:
+        EndpointPool: The pool.
+    """
+    key = tuple(urls)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = EndpointPool(list(urls))
+            if len(urls) > 1:
+                pool.check_health()
+            _pools[key] = pool
+        return pool
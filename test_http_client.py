@@ -0,0 +1,54 @@
+import random
+import time
+import unittest
+from unittest import mock
+
+import http_client
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    def run_requests(self, limiter, clock, latencies):
+        for latency in latencies:
+            limiter.acquire()
+            clock.now += latency
+            limiter.release(latency=latency)
+
+    def test_limit_holds_under_jittered_latency(self):
+        clock = SimulatedClock()
+        rng = random.Random(0)
+        limiter = http_client.AdaptiveLimiter(16)
+        with mock.patch.object(http_client.time, 'monotonic', clock):
+            self.run_requests(limiter, clock, [rng.uniform(0.05, 0.3) for _ in range(5000)])
+        self.assertEqual(int(limiter.limit), 16)
+
+    def test_limit_drops_when_latency_climbs(self):
+        clock = SimulatedClock()
+        rng = random.Random(0)
+        limiter = http_client.AdaptiveLimiter(16)
+        with mock.patch.object(http_client.time, 'monotonic', clock):
+            self.run_requests(limiter, clock, [rng.uniform(0.05, 0.1) for _ in range(2000)])
+            self.assertEqual(int(limiter.limit), 16)
+            self.run_requests(limiter, clock, [rng.uniform(1.0, 1.2) for _ in range(20)])
+        self.assertLess(limiter.limit, 16)
+
+    def test_throttling_halves_limit(self):
+        limiter = http_client.AdaptiveLimiter(16, initial_limit=16)
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertEqual(limiter.limit, 8)
+
+    def test_min_interval_spaces_requests(self):
+        limiter = http_client.AdaptiveLimiter(4, initial_limit=4, min_interval=0.05)
+        start = time.monotonic()
+        for _ in range(4):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+if __name__ == "__main__":
+    unittest.main()
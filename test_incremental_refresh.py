@@ -0,0 +1,61 @@
+import unittest
+
+from shapely.geometry import box
+
+from building_store import BuildingStoreBuilder, parse_timestamp
+from incremental_refresh import diff_buildings
+
+HARVESTED_AT = "2024-01-01T00:00:00Z"
+
+def store(*buildings):
+    builder = BuildingStoreBuilder()
+    for building_id, lat, lon, building_type, version, timestamp in buildings:
+        builder.append(building_id, lat, lon, building_type, version, parse_timestamp(timestamp))
+    return builder.build()
+
+def record(building_id, lat=0.5, lon=0.5, version=1, **extra):
+    return dict({'id': building_id, 'lat': lat, 'lon': lon, 'building_type': "house", 'version': version}, **extra)
+
+def ids(buildings):
+    return sorted(int(building['id']) for building in buildings)
+
+class DiffBuildingsTest(unittest.TestCase):
+    def setUp(self):
+        self.records = [
+            record(1),
+            record(2),
+            record(3),
+            record(4, deleted=True),
+            # Stored by an earlier bounding box harvest, outside the city polygon
+            record(5, lat=2.0, lon=2.0)
+        ]
+        self.current = store(
+            (1, 0.5, 0.5, "house", 1, "2023-06-01T00:00:00Z"),
+            (2, 0.5, 0.5, "house", 2, "2024-02-01T00:00:00Z"),
+            (4, 0.5, 0.5, "house", 2, "2024-02-01T00:00:00Z"),
+            (6, 0.5, 0.5, "yes", 1, "2024-02-01T00:00:00Z"),
+            (7, 0.5, 0.5, "house", 1, "2023-06-01T00:00:00Z"),
+            (8, 0.5, 0.5, "garage", 1, "2024-02-01T00:00:00Z")
+        )
+        self.polygon = box(0.0, 0.0, 1.0, 1.0)
+
+    def test_diff_with_index(self):
+        index = {"1": 1, "2": 1, "3": 1, "4": 1, "5": 1, "7": 1}
+        added, changed, removed = diff_buildings(self.records, self.current, HARVESTED_AT, index, self.polygon)
+        self.assertEqual(ids(added), [6])
+        self.assertEqual(ids(changed), [2, 4])
+        self.assertEqual(ids(removed), [3])
+
+    def test_diff_without_index_uses_edit_times(self):
+        added, changed, removed = diff_buildings(self.records, self.current, HARVESTED_AT, None, self.polygon)
+        # Building 7 was not sampled before and has not been edited since, so it is not new
+        self.assertEqual(ids(added), [6])
+        self.assertEqual(ids(changed), [2, 4])
+        self.assertEqual(ids(removed), [3])
+
+    def test_buildings_outside_polygon_count_as_removed_without_polygon(self):
+        _, _, removed = diff_buildings(self.records, self.current, HARVESTED_AT, None)
+        self.assertEqual(ids(removed), [3, 5])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,704 @@
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import numpy as np
+from tqdm import tqdm
+
+LAYER_NAME = "buildings"
+EXTENT = 4096
+MAX_LATITUDE = 85.0511287798
+# Record fields that are not building attributes; the OSM ID becomes the feature ID
+SKIPPED_FIELDS = ("id", "lat", "lon", "version", "timestamp", "deleted", "deleted_at")
+MISSING_VALUES = ("", "N/A", "n/a", "unknown", "none")
+NUMBER_PATTERN = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*(?:m|meters|metres)?\s*$")
+TILE_PATH = re.compile(r"^/(\d+)/(\d+)/(\d+)\.(?:pbf|mvt)$")
+
+# Mapbox Vector Tile encoding (https://github.com/mapbox/vector-tile-spec), written out by hand to avoid a protobuf dependency
+
+def encode_varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def zigzag_encode(value):
+    return (value << 1) ^ (value >> 63)
+
+def varint_field(field, value):
+    return encode_varint(field << 3) + encode_varint(value)
+
+def bytes_field(field, data):
+    return encode_varint(field << 3 | 2) + encode_varint(len(data)) + data
+
+def packed_field(field, values):
+    return bytes_field(field, b"".join(encode_varint(value) for value in values))
+
+def encode_value(value):
+    """
+    Encodes a property value as a vector tile Value message.
+
+    Parameters:
+        value (str, bool, int or float): The value.
+
+    Returns:
+        bytes: The encoded message.
+    """
+    if isinstance(value, bool):
+        return varint_field(7, int(value))
+    if isinstance(value, int):
+        return varint_field(5, value) if value >= 0 else varint_field(6, zigzag_encode(value))
+    if isinstance(value, float):
+        return encode_varint(3 << 3 | 1) + struct.pack('<d', value)
+    return bytes_field(1, str(value).encode('utf-8'))
+
+class LayerEncoder:
+    """
+    Builds one vector tile layer of point features, sharing keys and values between features.
+
+    Parameters:
+        name (str): Layer name.
+        extent (int): Size of the tile in tile coordinates.
+    """
+    def __init__(self, name=LAYER_NAME, extent=EXTENT):
+        self.name = name
+        self.extent = extent
+        self.keys = {}
+        self.values = {}
+        self.features = []
+
+    def index_of(self, table, item):
+        index = table.get(item)
+        if index is None:
+            index = table[item] = len(table)
+        return index
+
+    def add_point(self, px, py, properties, feature_id=None):
+        """
+        Adds a point feature.
+
+        Parameters:
+            px (int): Column within the tile, from 0 to `extent`.
+            py (int): Row within the tile, from 0 to `extent`.
+            properties (dict): Feature properties; None values are left out.
+            feature_id (int): Optional non-negative feature ID.
+        """
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(self.index_of(self.keys, key))
+            # The type is part of the key so that True and 1 stay distinct values
+            tags.append(self.index_of(self.values, (type(value).__name__, value)))
+        # MoveTo command with one point, followed by the zigzag-encoded position
+        geometry = (9, zigzag_encode(px), zigzag_encode(py))
+        feature = b""
+        if feature_id is not None and feature_id >= 0:
+            feature += varint_field(1, feature_id)
+        feature += packed_field(2, tags) + varint_field(3, 1) + packed_field(4, geometry)
+        self.features.append(bytes_field(2, feature))
+
+    def encode(self):
+        """
+        Returns:
+            bytes: A Tile message containing the layer.
+        """
+        layer = varint_field(15, 2) + bytes_field(1, self.name.encode('utf-8')) + b"".join(self.features)
+        layer += b"".join(bytes_field(3, key.encode('utf-8')) for key in self.keys)
+        layer += b"".join(bytes_field(4, encode_value(value)) for _, value in self.values)
+        layer += varint_field(5, self.extent)
+        return bytes_field(3, layer)
+
+# Reading and classifying the annotated dataset
+
+def parse_annotation(content):
+    """
+    Parses the annotation written by `openai.py` into flat properties.
+
+    Parameters:
+        content (str): The model output, ideally a JSON object, possibly wrapped in a Markdown code fence.
+
+    Returns:
+        dict: Scalar properties, with nested keys joined by '_' and lists joined by ', ', or None if it is not JSON.
+    """
+    if isinstance(content, dict):
+        annotation = content
+    else:
+        text = str(content).strip()
+        if text.startswith("```"):
+            text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
+        try:
+            annotation = json.loads(text)
+        except ValueError:
+            return None
+    if not isinstance(annotation, dict):
+        return None
+
+    properties = {}
+    def flatten(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                flatten(f"{prefix}_{key}" if prefix else key, item)
+        elif isinstance(value, list):
+            properties[prefix] = ", ".join(str(item) for item in value)
+        else:
+            properties[prefix] = value
+    flatten("", annotation)
+    return properties
+
+def parse_number(value):
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = NUMBER_PATTERN.match(str(value))
+    return float(match.group(1)) if match else None
+
+def is_missing(value):
+    return value is None or (isinstance(value, str) and value.strip().lower() in MISSING_VALUES)
+
+def load_buildings(jsonl_path):
+    """
+    Reads an annotated dataset as written to `result/` by `image_processing_pipeline.py`.
+
+    Parameters:
+        jsonl_path (str): Path to the JSONL file.
+
+    Returns:
+        tuple: Latitudes, longitudes and OSM IDs as arrays, and a list of property dicts.
+    """
+    lats = []
+    lons = []
+    ids = []
+    properties = []
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get('deleted') or record.get('lat') is None or record.get('lon') is None:
+                continue
+            building = {key: value for key, value in record.items() if key not in SKIPPED_FIELDS and key != 'content'}
+            if 'content' in record:
+                annotation = parse_annotation(record['content'])
+                if annotation is None:
+                    building['content'] = record['content']
+                else:
+                    building.update(annotation)
+            lats.append(float(record['lat']))
+            lons.append(float(record['lon']))
+            try:
+                ids.append(int(str(record.get('id')).strip('"')))
+            except ValueError:
+                ids.append(-1)
+            properties.append(building)
+    return np.array(lats), np.array(lons), np.array(ids, dtype=np.int64), properties
+
+def classify_attributes(properties, max_categories=32):
+    """
+    Splits the building attributes into columns that can be aggregated over many buildings.
+
+    An attribute is numeric if all its values are numbers (heights such as "12 m" included), and categorical if
+    it has at most `max_categories` distinct values. Other attributes, such as street names, are only shown on
+    single buildings.
+
+    Parameters:
+        properties (list): Property dicts of the buildings.
+        max_categories (int): Largest number of distinct values of a categorical attribute.
+
+    Returns:
+        tuple: Dicts of numeric columns (float arrays with NaN for missing values) and categorical columns
+            (int32 code arrays with -1 for missing values, and the list of values), keyed by attribute name.
+    """
+    names = {}
+    for building in properties:
+        for name in building:
+            names.setdefault(name, None)
+
+    numeric = {}
+    categorical = {}
+    for name in names:
+        values = [building.get(name) for building in properties]
+        present = [value for value in values if not is_missing(value)]
+        if not present:
+            continue
+        numbers = [parse_number(value) for value in present]
+        if all(number is not None for number in numbers):
+            numeric[name] = np.array([np.nan if is_missing(value) else parse_number(value) for value in values])
+            continue
+        distinct = {}
+        for value in present:
+            # Values are told apart by their text but keep the type of their first occurrence, e.g. booleans
+            distinct.setdefault(str(value), value)
+            if len(distinct) > max_categories:
+                break
+        if len(distinct) <= max_categories:
+            index = {key: code for code, key in enumerate(distinct)}
+            codes = np.array([-1 if is_missing(value) else index[str(value)] for value in values], dtype=np.int32)
+            categorical[name] = (codes, list(distinct.values()))
+    return numeric, categorical
+
+# Tiling
+
+def mercator(lats, lons):
+    """
+    Projects coordinates to Web Mercator, scaled to the unit square with y pointing south.
+
+    Returns:
+        tuple: x and y arrays in [0, 1).
+    """
+    lat_rad = np.radians(np.clip(lats, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (lons + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / math.pi) / 2.0
+    limit = np.nextafter(1.0, 0.0)
+    return np.clip(x, 0.0, limit), np.clip(y, 0.0, limit)
+
+def merge_cells(gx, gy, count, sx, sy, numeric, categorical, cells_per_axis):
+    """
+    Sums buildings or finer cells into the grid cells containing them.
+
+    Parameters:
+        gx (numpy.ndarray): Cell column of each input at the target level.
+        gy (numpy.ndarray): Cell row of each input at the target level.
+        count (numpy.ndarray): Number of buildings of each input.
+        sx (numpy.ndarray): Sum of the x coordinates of each input.
+        sy (numpy.ndarray): Sum of the y coordinates of each input.
+        numeric (dict): (sum, number of values) arrays per numeric attribute.
+        categorical (dict): (input index, value code, number of buildings) arrays per categorical attribute.
+        cells_per_axis (int): Number of cells along each axis of the world at the target level.
+
+    Returns:
+        dict: The cells, in the same form as the inputs.
+    """
+    keys, inverse = np.unique(gx * cells_per_axis + gy, return_inverse=True)
+    size = len(keys)
+    level = {
+        'gx': keys // cells_per_axis,
+        'gy': keys % cells_per_axis,
+        'count': np.bincount(inverse, weights=count, minlength=size),
+        'sx': np.bincount(inverse, weights=sx, minlength=size),
+        'sy': np.bincount(inverse, weights=sy, minlength=size),
+        'numeric': {},
+        'categorical': {}
+    }
+    for name, (total, counted) in numeric.items():
+        level['numeric'][name] = (np.bincount(inverse, weights=total, minlength=size),
+                                  np.bincount(inverse, weights=counted, minlength=size))
+    for name, (cells, codes, counts) in categorical.items():
+        stride = int(codes.max()) + 1 if len(codes) else 1
+        pair_keys, pair_inverse = np.unique(inverse[cells] * stride + codes, return_inverse=True)
+        level['categorical'][name] = (pair_keys // stride, pair_keys % stride,
+                                      np.bincount(pair_inverse, weights=counts, minlength=len(pair_keys)))
+    return level
+
+def most_common(cells, codes, counts, size):
+    """
+    Finds the most common value of a categorical attribute in each cell.
+
+    Returns:
+        tuple: The value code per cell (-1 if no building has a value) and its share of the buildings with a value.
+    """
+    mode = np.full(size, -1, dtype=np.int64)
+    share = np.zeros(size)
+    if len(cells):
+        order = np.lexsort((-counts, cells))
+        first = order[np.r_[True, cells[order][1:] != cells[order][:-1]]]
+        totals = np.bincount(cells, weights=counts, minlength=size)
+        mode[cells[first]] = codes[first]
+        share[cells[first]] = counts[first] / totals[cells[first]]
+    return mode, share
+
+def aggregate_levels(x, y, numeric, categorical, min_zoom, max_zoom, grid):
+    """
+    Aggregates buildings into a grid of `grid` x `grid` cells per tile, from `max_zoom` down to `min_zoom`.
+
+    Each level is computed from the one below it, so every building is touched once.
+
+    Yields:
+        tuple: The zoom level and its cells as returned by `merge_cells`.
+    """
+    cells_per_axis = 2 ** max_zoom * grid
+    gx = np.minimum((x * cells_per_axis).astype(np.int64), cells_per_axis - 1)
+    gy = np.minimum((y * cells_per_axis).astype(np.int64), cells_per_axis - 1)
+    point_numeric = {name: (np.nan_to_num(values), (~np.isnan(values)).astype(np.float64)) for name, values in numeric.items()}
+    point_categorical = {}
+    for name, (codes, _) in categorical.items():
+        present = np.flatnonzero(codes >= 0)
+        point_categorical[name] = (present, codes[present].astype(np.int64), np.ones(len(present)))
+    level = merge_cells(gx, gy, np.ones(len(x)), x, y, point_numeric, point_categorical, cells_per_axis)
+    yield max_zoom, level
+    for zoom in range(max_zoom - 1, min_zoom - 1, -1):
+        cells_per_axis //= 2
+        level = merge_cells(level['gx'] // 2, level['gy'] // 2, level['count'], level['sx'], level['sy'],
+                            level['numeric'], level['categorical'], cells_per_axis)
+        yield zoom, level
+
+def tile_positions(x, y, zoom):
+    """
+    Returns:
+        tuple: Tile column, tile row, and the position within the tile for each point.
+    """
+    scale = 2 ** zoom
+    tile_x = np.minimum((x * scale).astype(np.int64), scale - 1)
+    tile_y = np.minimum((y * scale).astype(np.int64), scale - 1)
+    px = np.clip(np.round((x * scale - tile_x) * EXTENT), 0, EXTENT - 1).astype(np.int64)
+    py = np.clip(np.round((y * scale - tile_y) * EXTENT), 0, EXTENT - 1).astype(np.int64)
+    return tile_x, tile_y, px, py
+
+def group_by_tile(tile_x, tile_y):
+    """
+    Yields:
+        tuple: Tile column, tile row and the indexes of the features in the tile.
+    """
+    order = np.lexsort((tile_y, tile_x))
+    keys = tile_x[order] * (2 ** 32) + tile_y[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    for start, end in zip(starts, ends):
+        index = order[start]
+        yield int(tile_x[index]), int(tile_y[index]), order[start:end]
+
+def compress(tile):
+    # A fixed mtime keeps the bytes, and so the ETags, stable across exports
+    return gzip.compress(tile, compresslevel=6, mtime=0)
+
+def building_tiles(x, y, ids, properties, numeric, zoom):
+    """
+    Encodes the buildings as single features with all their attributes, numeric ones as numbers.
+
+    Yields:
+        tuple: Zoom, tile column, tile row and the gzipped tile.
+    """
+    tile_x, tile_y, px, py = tile_positions(x, y, zoom)
+    for column, row, indexes in group_by_tile(tile_x, tile_y):
+        layer = LayerEncoder()
+        for i in indexes.tolist():
+            building = {key: parse_number(value) if key in numeric and isinstance(value, str) else value
+                        for key, value in properties[i].items() if not is_missing(value)}
+            layer.add_point(int(px[i]), int(py[i]), building, int(ids[i]))
+        yield zoom, column, row, compress(layer.encode())
+
+def cell_tiles(level, zoom, categorical):
+    """
+    Encodes the cells of an aggregated level as features with the number of buildings, the mean of numeric
+    attributes and the most common value of categorical attributes with its share.
+
+    Yields:
+        tuple: Zoom, tile column, tile row and the gzipped tile.
+    """
+    count = level['count']
+    size = len(count)
+    # Place each cell's feature at the mean position of its buildings
+    tile_x, tile_y, px, py = tile_positions(level['sx'] / count, level['sy'] / count, zoom)
+    means = {name: np.where(counted > 0, total / np.maximum(counted, 1), np.nan)
+             for name, (total, counted) in level['numeric'].items()}
+    modes = {name: most_common(cells, codes, counts, size) for name, (cells, codes, counts) in level['categorical'].items()}
+    for column, row, indexes in group_by_tile(tile_x, tile_y):
+        layer = LayerEncoder()
+        for i in indexes.tolist():
+            cell = {'count': int(count[i])}
+            for name, values in means.items():
+                if not np.isnan(values[i]):
+                    cell[name] = round(float(values[i]), 2)
+            for name, (mode, share) in modes.items():
+                if mode[i] >= 0:
+                    cell[name] = categorical[name][1][mode[i]]
+                    cell[f"{name}_share"] = round(float(share[i]), 2)
+            layer.add_point(int(px[i]), int(py[i]), cell)
+        yield zoom, column, row, compress(layer.encode())
+
+def write_mbtiles(mbtiles_path, tiles, metadata):
+    """
+    Writes tiles to an MBTiles file, replacing any existing file.
+
+    Parameters:
+        mbtiles_path (str): Path of the .mbtiles file.
+        tiles (iterable): (zoom, column, row, data) tuples with rows counted from the north as in XYZ tile URLs.
+        metadata (dict): Values for the metadata table.
+
+    Returns:
+        int: Number of tiles written.
+    """
+    os.makedirs(os.path.dirname(mbtiles_path) or '.', exist_ok=True)
+    if os.path.exists(mbtiles_path):
+        os.remove(mbtiles_path)
+    connection = sqlite3.connect(mbtiles_path)
+    written = 0
+    try:
+        connection.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        connection.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+        connection.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+        connection.executemany("INSERT INTO metadata (name, value) VALUES (?, ?)", metadata.items())
+        batch = []
+        for zoom, column, row, data in tiles:
+            # MBTiles counts rows from the south (TMS)
+            batch.append((zoom, column, 2 ** zoom - 1 - row, data))
+            if len(batch) >= 1000:
+                connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", batch)
+                written += len(batch)
+                batch = []
+        connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", batch)
+        written += len(batch)
+        connection.commit()
+    finally:
+        connection.close()
+    return written
+
+def export_vector_tiles(jsonl_path, mbtiles_path, min_zoom=0, max_zoom=14, grid=64, max_categories=32):
+    """
+    Exports an annotated dataset to an MBTiles file of vector tiles.
+
+    At `max_zoom` every building is a point feature with all its attributes; map clients overzoom beyond it.
+    Below it, buildings are aggregated into a grid of `grid` x `grid` cells per tile, so tile sizes stay bounded
+    however many buildings the dataset has.
+
+    Parameters:
+        jsonl_path (str): Path to the annotated JSONL file.
+        mbtiles_path (str): Path of the .mbtiles file to write.
+        min_zoom (int): Lowest zoom level.
+        max_zoom (int): Zoom level with single buildings.
+        grid (int): Aggregation cells along each side of a tile.
+        max_categories (int): Largest number of distinct values of an aggregated categorical attribute.
+
+    Returns:
+        int: Number of tiles written, or 0 if the dataset has no buildings.
+    """
+    lats, lons, ids, properties = load_buildings(jsonl_path)
+    if not properties:
+        print(f"No buildings in {jsonl_path}")
+        return 0
+    numeric, categorical = classify_attributes(properties, max_categories)
+    x, y = mercator(lats, lons)
+
+    def tiles():
+        yield from building_tiles(x, y, ids, properties, numeric, max_zoom)
+        if max_zoom > min_zoom:
+            for zoom, level in aggregate_levels(x, y, numeric, categorical, min_zoom, max_zoom - 1, grid):
+                yield from cell_tiles(level, zoom, categorical)
+
+    fields = {name: "String" for building in properties for name in building}
+    fields.update({name: "Number" for name in numeric})
+    fields.update({name: "Boolean" for name, (_, values) in categorical.items() if all(isinstance(value, bool) for value in values)})
+    fields['count'] = "Number"
+    fields.update({f"{name}_share": "Number" for name in categorical})
+    bounds = [float(lons.min()), float(lats.min()), float(lons.max()), float(lats.max())]
+    metadata = {
+        'name': os.path.splitext(os.path.basename(mbtiles_path))[0],
+        'format': "pbf",
+        'type': "overlay",
+        'version': "1",
+        'description': f"Annotated buildings from {os.path.basename(jsonl_path)}",
+        'minzoom': str(min_zoom),
+        'maxzoom': str(max_zoom),
+        'bounds': ",".join(f"{value:.6f}" for value in bounds),
+        'center': f"{(bounds[0] + bounds[2]) / 2:.6f},{(bounds[1] + bounds[3]) / 2:.6f},{min(max_zoom, max(min_zoom, 12))}",
+        'json': json.dumps({'vector_layers': [{'id': LAYER_NAME, 'fields': fields, 'minzoom': min_zoom, 'maxzoom': max_zoom}]})
+    }
+    written = write_mbtiles(mbtiles_path, tqdm(tiles(), desc="Writing tiles"), metadata)
+    print(f"Exported {len(properties)} buildings to {written} tiles in {mbtiles_path}")
+    return written
+
+# Serving
+
+VIEWER_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{name}</title>
+<link rel="stylesheet" href="https://unpkg.com/maplibre-gl@4/dist/maplibre-gl.css">
+<script src="https://unpkg.com/maplibre-gl@4/dist/maplibre-gl.js"></script>
+<style>html, body, #map {{ margin: 0; height: 100%; }}</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+const map = new maplibregl.Map({{
+  container: 'map',
+  center: [{lon}, {lat}],
+  zoom: {zoom},
+  style: {{
+    version: 8,
+    sources: {{
+      osm: {{type: 'raster', tiles: ['https://tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png'], tileSize: 256,
+             attribution: '&copy; OpenStreetMap contributors'}},
+      buildings: {{type: 'vector', url: '/tiles.json'}}
+    }},
+    layers: [
+      {{id: 'osm', type: 'raster', source: 'osm'}},
+      {{id: 'buildings', type: 'circle', source: 'buildings', 'source-layer': '{layer}', paint: {{
+        'circle-radius': ['interpolate', ['linear'], ['sqrt', ['coalesce', ['get', 'count'], 1]], 1, 4, 30, 18],
+        'circle-color': ['match', ['get', 'building_type'], 'house', '#1b9e77', 'commercial', '#d95f02', 'yes', '#7570b3', '#666666'],
+        'circle-opacity': 0.7, 'circle-stroke-width': 1, 'circle-stroke-color': '#ffffff'
+      }}}}
+    ]
+  }}
+}});
+map.on('click', 'buildings', (e) => {{
+  const rows = Object.entries(e.features[0].properties).map(([k, v]) => `<b>${{k}}</b>: ${{v}}`).join('<br>');
+  new maplibregl.Popup().setLngLat(e.lngLat).setHTML(rows).addTo(map);
+}});
+</script>
+</body>
+</html>
+"""
+
+class TileSet:
+    """
+    Read-only access to an MBTiles file, shared by the server threads.
+
+    Parameters:
+        mbtiles_path (str): Path of the .mbtiles file.
+    """
+    def __init__(self, mbtiles_path):
+        self.connection = sqlite3.connect(f"file:{mbtiles_path}?mode=ro", uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.metadata = dict(self.connection.execute("SELECT name, value FROM metadata"))
+
+    def get_tile(self, zoom, column, row):
+        """
+        Returns:
+            bytes: The gzipped tile, or None if there is none at the XYZ address.
+        """
+        with self.lock:
+            result = self.connection.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (zoom, column, 2 ** zoom - 1 - row)).fetchone()
+        return result[0] if result else None
+
+    def tilejson(self, base_url):
+        metadata = self.metadata
+        tilejson = {
+            'tilejson': "3.0.0",
+            'name': metadata.get('name'),
+            'tiles': [f"{base_url}/{{z}}/{{x}}/{{y}}.pbf"],
+            'minzoom': int(metadata.get('minzoom', 0)),
+            'maxzoom': int(metadata.get('maxzoom', 14)),
+            'bounds': [float(value) for value in metadata.get('bounds', "-180,-85,180,85").split(',')],
+            'center': [float(value) for value in metadata.get('center', "0,0,0").split(',')],
+        }
+        tilejson.update(json.loads(metadata.get('json', '{}')))
+        return tilejson
+
+class TileHandler(BaseHTTPRequestHandler):
+    """Serves /{z}/{x}/{y}.pbf tiles, /tiles.json and a map viewer at /."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        tileset = self.server.tileset
+        path = urlparse(self.path).path
+        match = TILE_PATH.match(path)
+        if match:
+            self.send_tile(*(int(value) for value in match.groups()))
+        elif path == "/tiles.json":
+            base_url = f"http://{self.headers.get('Host', '%s:%d' % self.server.server_address[:2])}"
+            body = json.dumps(tileset.tilejson(base_url)).encode('utf-8')
+            self.send_body(200, body, "application/json", {"Cache-Control": "no-cache"})
+        elif path in ("/", "/index.html"):
+            lon, lat, zoom = tileset.metadata.get('center', "0,0,2").split(',')
+            body = VIEWER_HTML.format(name=tileset.metadata.get('name', ""), lon=lon, lat=lat, zoom=zoom, layer=LAYER_NAME)
+            self.send_body(200, body.encode('utf-8'), "text/html; charset=utf-8", {"Cache-Control": "no-cache"})
+        else:
+            self.send_body(404, b"Not found", "text/plain")
+
+    def send_tile(self, zoom, column, row):
+        cache_control = f"public, max-age={self.server.max_age}"
+        tile = self.server.tileset.get_tile(zoom, column, row)
+        if tile is None:
+            # Empty areas are cached too, so clients do not ask again while panning
+            self.send_body(204, b"", "application/vnd.mapbox-vector-tile", {"Cache-Control": cache_control})
+            return
+        # Tiles are stored gzipped; only clients that cannot take gzip get them decompressed. The two encodings are
+        # different bytes, so each gets its own strong ETag
+        use_gzip = 'gzip' in self.headers.get('Accept-Encoding', "")
+        digest = hashlib.md5(tile).hexdigest()
+        etag = f'"{digest}-gzip"' if use_gzip else f'"{digest}"'
+        headers = {"Cache-Control": cache_control, "ETag": etag, "Vary": "Accept-Encoding"}
+        # If-None-Match uses the weak comparison, so tags weakened by a proxy still match
+        if etag in [tag.strip().removeprefix("W/") for tag in self.headers.get('If-None-Match', "").split(',')]:
+            self.send_response(304)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            return
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+        else:
+            tile = gzip.decompress(tile)
+        self.send_body(200, tile, "application/vnd.mapbox-vector-tile", headers)
+
+def serve(mbtiles_path, host="127.0.0.1", port=8080, max_age=86400):
+    """
+    Serves an MBTiles file over HTTP until interrupted.
+
+    Parameters:
+        mbtiles_path (str): Path of the .mbtiles file.
+        host (str): Address to listen on.
+        port (int): Port to listen on.
+        max_age (int): Seconds clients may cache tiles.
+    """
+    server = ThreadingHTTPServer((host, port), TileHandler)
+    server.daemon_threads = True
+    server.tileset = TileSet(mbtiles_path)
+    server.max_age = max_age
+    print(f"Serving {mbtiles_path} at http://{host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export annotated buildings to vector tiles and serve them.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Write an MBTiles file from an annotated JSONL file.')
+    export_parser.add_argument('input_file_path', type=str, help='Annotated JSONL file, e.g. from result/.')
+    export_parser.add_argument('--output', type=str, help='MBTiles file to write; defaults to export/<name>/<name>.mbtiles.')
+    export_parser.add_argument('--min_zoom', type=int, default=0, help='Lowest zoom level.')
+    export_parser.add_argument('--max_zoom', type=int, default=14, help='Zoom level with single buildings.')
+    export_parser.add_argument('--grid', type=int, default=64, help='Aggregation cells along each side of a tile.')
+    export_parser.add_argument('--max_categories', type=int, default=32,
+                               help='Largest number of distinct values of an aggregated attribute.')
+
+    serve_parser = subparsers.add_parser('serve', help='Serve an MBTiles file with a map viewer.')
+    serve_parser.add_argument('mbtiles_path', type=str, help='MBTiles file to serve.')
+    serve_parser.add_argument('--host', type=str, default="127.0.0.1", help='Address to listen on.')
+    serve_parser.add_argument('--port', type=int, default=8080, help='Port to listen on.')
+    serve_parser.add_argument('--max_age', type=int, default=86400, help='Seconds clients may cache tiles.')
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        base_filename = os.path.splitext(os.path.basename(args.input_file_path))[0]
+        output = args.output or os.path.join('export', base_filename, f"{base_filename}.mbtiles")
+        export_vector_tiles(args.input_file_path, output, args.min_zoom, args.max_zoom, args.grid, args.max_categories)
+    else:
+        serve(args.mbtiles_path, args.host, args.port, args.max_age)